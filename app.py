@@ -1,13 +1,29 @@
+from datetime import timedelta
+
 from fastapi import FastAPI
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 from fastapi.requests import Request
 from fastapi.responses import JSONResponse
+from fastapi.staticfiles import StaticFiles
 
 from config.settings import settings
+from models.carts import Cart
 from routes import authors, books, carts, users
+from utils import metrics
+from utils.cart_archive import CartArchiver
+from utils.cart_sync import CartWriteBehind
+from utils.catalog import CatalogSnapshot
+from utils.compression import CompressionMiddleware
 from utils.database import init_db
+from utils.facets import FacetRefresher
+from utils.idempotency import IdempotencyMiddleware
+from utils.images import init_image_pool, shutdown_image_pool
+from utils.limiter import AIMDLimiter, LoadSheddingMiddleware
+from utils.readiness import Readiness
 from utils.redis import init_redis
+from utils.storage import init_storage
+from utils.trending import TrendingRecorder
 
 
 def create_app() -> FastAPI:
@@ -16,6 +32,34 @@ def create_app() -> FastAPI:
     app.include_router(authors.router, prefix="/authors", tags=["authors"])
     app.include_router(books.router, prefix="/books", tags=["books"])
     app.include_router(carts.router, prefix="/carts", tags=["carts"])
+    # innermost, so replayed responses are compressed like fresh ones
+    app.add_middleware(
+        IdempotencyMiddleware,
+        paths=("/books/", "/users/register"),
+        ttl=settings.IDEMPOTENCY_TTL_SECONDS,
+        lock_timeout=settings.IDEMPOTENCY_LOCK_SECONDS,
+        wait=settings.IDEMPOTENCY_WAIT_SECONDS,
+    )
+    app.add_middleware(
+        CompressionMiddleware, minimum_size=settings.COMPRESSION_MINIMUM_SIZE
+    )
+    if settings.LIMITER_ENABLED:
+        # wraps compression and the routers, so shed requests do no work
+        app.add_middleware(
+            LoadSheddingMiddleware,
+            limiter=AIMDLimiter(
+                initial=settings.LIMITER_INITIAL,
+                minimum=settings.LIMITER_MIN,
+                maximum=settings.LIMITER_MAX,
+                target_latency=settings.LIMITER_TARGET_LATENCY_SECONDS,
+            ),
+        )
+    if settings.IMAGE_STORAGE == "local":
+        app.mount(
+            settings.MEDIA_URL,
+            StaticFiles(directory=settings.MEDIA_ROOT, check_dir=False),
+            name="media",
+        )
     return app
 
 
@@ -44,8 +88,79 @@ async def check_jwt_blacklist(request: Request, call_next):
 
 @app.on_event("startup")
 async def startup_event() -> None:
-    await init_db()
+    app.state.mongo = await init_db()
     app.state.redis = await init_redis()
+    app.state.readiness = Readiness(
+        app.state.mongo,
+        app.state.redis,
+        mongo_pool_size=settings.MONGO_MIN_POOL_SIZE,
+        redis_pool_size=settings.REDIS_MIN_POOL_SIZE,
+        lag_interval=settings.EVENT_LOOP_LAG_INTERVAL_SECONDS,
+    )
+    await app.state.readiness.start()
+    app.state.storage = init_storage(
+        settings.IMAGE_STORAGE,
+        media_root=settings.MEDIA_ROOT,
+        media_url=settings.MEDIA_URL,
+    )
+    init_image_pool(settings.IMAGE_WORKERS)
+    app.state.cart_writer = None
+    if settings.CART_STORAGE == "redis":
+        Cart.use_redis(app.state.redis, ttl_seconds=settings.CART_REDIS_TTL_SECONDS)
+        app.state.cart_writer = CartWriteBehind(
+            app.state.redis,
+            interval=settings.CART_FLUSH_INTERVAL_SECONDS,
+            batch_size=settings.CART_FLUSH_BATCH_SIZE,
+        )
+        await app.state.cart_writer.start()
+    app.state.cart_archiver = None
+    if settings.CART_ARCHIVE_ENABLED:
+        app.state.cart_archiver = CartArchiver(
+            max_idle=timedelta(days=settings.CART_ARCHIVE_AFTER_DAYS),
+            interval=settings.CART_ARCHIVE_INTERVAL_SECONDS,
+            batch_size=settings.CART_ARCHIVE_BATCH_SIZE,
+            pause=settings.CART_ARCHIVE_PAUSE_SECONDS,
+            redis=Cart.redis,
+        )
+        await app.state.cart_archiver.start()
+    app.state.catalog = None
+    if settings.CATALOG_SNAPSHOT:
+        app.state.catalog = CatalogSnapshot(
+            max_staleness=settings.CATALOG_MAX_STALENESS_SECONDS
+        )
+        await app.state.catalog.start()
+    app.state.trending = None
+    if settings.TRENDING_ENABLED:
+        app.state.trending = TrendingRecorder(
+            app.state.redis,
+            flush_interval=settings.TRENDING_FLUSH_INTERVAL_SECONDS,
+            bucket_seconds=settings.TRENDING_BUCKET_SECONDS,
+            buckets=settings.TRENDING_BUCKETS,
+            max_pending=settings.TRENDING_MAX_PENDING,
+        )
+        await app.state.trending.start()
+    app.state.facet_refresher = None
+    if settings.FACETS_REFRESH_ENABLED:
+        app.state.facet_refresher = FacetRefresher(
+            app.state.redis, interval=settings.FACETS_REFRESH_INTERVAL_SECONDS
+        )
+        await app.state.facet_refresher.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event() -> None:
+    await app.state.readiness.stop()
+    shutdown_image_pool()
+    if app.state.cart_writer:
+        await app.state.cart_writer.stop()
+    if app.state.cart_archiver:
+        await app.state.cart_archiver.stop()
+    if app.state.catalog:
+        await app.state.catalog.stop()
+    if app.state.facet_refresher:
+        await app.state.facet_refresher.stop()
+    if app.state.trending:
+        await app.state.trending.stop()
 
 
 @app.get("/healthcheck")
@@ -53,6 +168,25 @@ async def healthcheck():
     return {"status": "ok"}
 
 
+@app.get("/readiness")
+async def readiness():
+    """Ready once the pools are warm and Mongo and Redis answer"""
+    reason = await app.state.readiness.check()
+    return JSONResponse(
+        status_code=503 if reason else 200,
+        content={
+            "status": "not ready" if reason else "ready",
+            "reason": reason,
+            **app.state.readiness.stats(),
+        },
+    )
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return metrics.collect()
+
+
 if __name__ == "__main__":
     import uvicorn
 
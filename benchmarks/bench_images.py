@@ -0,0 +1,85 @@
+"""Benchmark the image ingestion pipeline against local-disk storage.
+
+python -m benchmarks.bench_images --images 40 --workers 4
+"""
+
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+from io import BytesIO
+
+from PIL import Image
+
+from utils import images
+from utils.storage import LocalStorage
+
+
+def make_cover(seed: int, size=(1000, 1500)) -> bytes:
+    """A noisy jpeg roughly the size of a scanned cover."""
+    rng = random.Random(seed)
+    image = Image.effect_noise(size, 64).convert("RGB")
+    image.paste(
+        (rng.randrange(256), rng.randrange(256), rng.randrange(256)),
+        (0, 0, size[0] // 2, size[1] // 3),
+    )
+    out = BytesIO()
+    image.save(out, "JPEG", quality=85)
+    return out.getvalue()
+
+
+async def ingest(storage: LocalStorage, data: bytes, seen: set[str]) -> int:
+    """Run one upload through the pipeline and return the bytes stored."""
+    image_hash = images.content_hash(data)
+    if image_hash in seen:
+        return 0
+    seen.add(image_hash)
+    renditions = await images.process_image(data)
+    await images.upload_renditions(storage, image_hash, renditions)
+    return sum(len(rendition.data) for rendition in renditions)
+
+
+async def run(covers: list[bytes], storage: LocalStorage, concurrency: int):
+    seen: set[str] = set()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(data: bytes) -> int:
+        async with semaphore:
+            return await ingest(storage, data, seen)
+
+    started = time.perf_counter()
+    stored = await asyncio.gather(*(one(data) for data in covers))
+    return time.perf_counter() - started, sum(stored)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=40)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--duplicates", type=float, default=0.5, help="share of re-uploaded covers"
+    )
+    args = parser.parse_args()
+
+    unique = max(1, int(args.images * (1 - args.duplicates)))
+    originals = [make_cover(seed) for seed in range(unique)]
+    covers = [originals[i % unique] for i in range(args.images)]
+    raw_bytes = sum(len(data) for data in covers)
+    print(f"{args.images} uploads, {unique} unique, {raw_bytes / 1e6:.1f} MB raw")
+
+    for label, workers in (("thread pool", 0), ("process pool", args.workers)):
+        if workers:
+            images.init_image_pool(workers)
+        with tempfile.TemporaryDirectory() as root:
+            storage = LocalStorage(root=root, base_url="/media")
+            elapsed, stored = asyncio.run(run(covers, storage, args.workers))
+        images.shutdown_image_pool()
+        print(
+            f"{label:>12}: {elapsed:6.2f}s, {args.images / elapsed:6.1f} uploads/s, "
+            f"{stored / 1e6:.2f} MB stored"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,7 @@ class Settings(BaseSettings):
     DEBUG: bool = True
     MONGO_URI: str
     MONGO_DB: str
+    MONGO_MIN_POOL_SIZE: int = 10
     SMTP_USERNAME: str
     SMTP_PASSWORD: str
     SMTP_PORT: int
@@ -15,6 +16,41 @@ class Settings(BaseSettings):
     JWT_EXPIRY_MINUTES: int
     REDIS_URL: str
     CLOUDINARY_URL: str
+    IMAGE_STORAGE: str = "cloudinary"
+    IMAGE_FORMAT: str = "webp"
+    IMAGE_QUALITY: int = 80
+    IMAGE_WORKERS: int = 2
+    MEDIA_ROOT: str = "media"
+    MEDIA_URL: str = "/media"
+    COMPRESSION_MINIMUM_SIZE: int = 1024
+    CART_STORAGE: str = "mongo"
+    CART_FLUSH_INTERVAL_SECONDS: float = 1.0
+    CART_FLUSH_BATCH_SIZE: int = 500
+    CART_REDIS_TTL_SECONDS: int = 7 * 24 * 60 * 60
+    CART_ARCHIVE_ENABLED: bool = True
+    CART_ARCHIVE_AFTER_DAYS: int = 30
+    CART_ARCHIVE_INTERVAL_SECONDS: float = 60 * 60
+    CART_ARCHIVE_BATCH_SIZE: int = 500
+    CART_ARCHIVE_PAUSE_SECONDS: float = 0.5
+    TRENDING_ENABLED: bool = True
+    TRENDING_FLUSH_INTERVAL_SECONDS: float = 2.0
+    TRENDING_BUCKET_SECONDS: int = 60 * 60
+    TRENDING_BUCKETS: int = 24
+    TRENDING_MAX_PENDING: int = 10_000
+    IDEMPOTENCY_TTL_SECONDS: int = 24 * 60 * 60
+    IDEMPOTENCY_LOCK_SECONDS: int = 60
+    IDEMPOTENCY_WAIT_SECONDS: float = 10.0
+    REDIS_MIN_POOL_SIZE: int = 10
+    EVENT_LOOP_LAG_INTERVAL_SECONDS: float = 0.5
+    LIMITER_ENABLED: bool = True
+    LIMITER_INITIAL: int = 100
+    LIMITER_MIN: int = 10
+    LIMITER_MAX: int = 1000
+    LIMITER_TARGET_LATENCY_SECONDS: float = 0.25
+    CATALOG_SNAPSHOT: bool = False
+    CATALOG_MAX_STALENESS_SECONDS: float = 5.0
+    FACETS_REFRESH_ENABLED: bool = True
+    FACETS_REFRESH_INTERVAL_SECONDS: float = 15 * 60
     model_config = SettingsConfigDict(env_file=".env")
 
 
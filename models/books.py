@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Optional
 
 from beanie import Document, Indexed, PydanticObjectId
 from pydantic import Field
@@ -6,14 +7,27 @@ from pydantic import Field
 
 class Book(Document):
     title: Indexed(str)
-    isbn: str
+    isbn: Indexed(str, unique=True)
     price: int
     description: str
     lanugage: str
     author_id: PydanticObjectId
     genre: list[str]
     image_url: str
+    images: dict[str, str] = {}
+    image_hash: Optional[Indexed(str)] = None
     created_at: datetime
 
     class Settings:
         name = "books"
+        # facet counts are recomputed per genre, language and author
+        indexes = ["genre", "lanugage", "author_id"]
+
+    @classmethod
+    async def existing_ids(
+        cls, book_ids: list[PydanticObjectId]
+    ) -> set[PydanticObjectId]:
+        """The ids among `book_ids` that belong to a book, in one query."""
+        if not book_ids:
+            return set()
+        return set(await cls.distinct("_id", {"_id": {"$in": list(set(book_ids))}}))
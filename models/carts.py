@@ -1,17 +1,233 @@
+from datetime import datetime
+from typing import Any, ClassVar, Optional
+
 from beanie import Document, PydanticObjectId
+from beanie.operators import In
 from pydantic import Field
 
 from models.books import Book
-from schemas.carts import CartItemSchema
+from schemas.carts import CartItemSchema, CartOperationSchema
+
+# set of user ids whose redis cart has changes not yet written to mongo
+DIRTY_CARTS_KEY = "carts:dirty"
+# hash field holding the cart's document id next to the book_id -> quantity
+CART_ID_FIELD = "_id"
+
+
+CART_KEY_PREFIX = "cart:"
+# book ids sent to `REMOVE_BOOKS_SCRIPT` per call
+REMOVE_BOOKS_CHUNK = 1000
+
+
+def cart_key(user_id: PydanticObjectId) -> str:
+    return f"{CART_KEY_PREFIX}{user_id}"
+
+
+def items_from_hash(raw: dict[bytes, bytes]) -> list[dict[str, Any]]:
+    """The book_id -> quantity fields of a redis cart as `cart_items`."""
+    return [
+        {"book_id": PydanticObjectId(field.decode()), "quantity": int(value)}
+        for field, value in raw.items()
+        if field != CART_ID_FIELD.encode()
+    ]
+
+
+# applies a batch of (op, book_id, quantity) to one cart hash atomically
+APPLY_OPERATIONS_SCRIPT = """
+local results = {}
+for i = 3, #ARGV, 3 do
+    local op, book_id, quantity = ARGV[i], ARGV[i + 1], ARGV[i + 2]
+    if op == "add" then
+        redis.call("HINCRBY", KEYS[1], book_id, quantity)
+        table.insert(results, "ok")
+    elseif redis.call("HEXISTS", KEYS[1], book_id) == 0 then
+        table.insert(results, "not_in_cart")
+    elseif op == "update" then
+        redis.call("HSET", KEYS[1], book_id, quantity)
+        table.insert(results, "ok")
+    else
+        redis.call("HDEL", KEYS[1], book_id)
+        table.insert(results, "ok")
+    end
+end
+redis.call("EXPIRE", KEYS[1], ARGV[1])
+redis.call("SADD", KEYS[2], ARGV[2])
+return results
+"""
+
+
+# drops the given book fields from each cart hash and marks changed carts
+# dirty, so the write-behind cannot put the books back
+REMOVE_BOOKS_SCRIPT = """
+local changed = 0
+for i = 2, #KEYS do
+    if redis.call("HDEL", KEYS[i], unpack(ARGV, 2)) > 0 then
+        redis.call("SADD", KEYS[1], string.sub(KEYS[i], tonumber(ARGV[1]) + 1))
+        changed = changed + 1
+    end
+end
+return changed
+"""
+
+
+class CartConflictError(Exception):
+    """The cart kept changing while a batch was being applied."""
+
+
+def plan_operations(
+    quantities: dict[PydanticObjectId, int],
+    operations: list[CartOperationSchema],
+    known_books: set[PydanticObjectId],
+) -> tuple[dict[PydanticObjectId, int], list[str]]:
+    """Apply `operations` to a copy of `quantities`, one result per operation."""
+    quantities = dict(quantities)
+    results = []
+    for operation in operations:
+        book_id = operation.book_id
+        if book_id not in known_books:
+            results.append("book_not_found")
+            continue
+        if operation.op == "add":
+            quantities[book_id] = quantities.get(book_id, 0) + operation.quantity
+        elif book_id not in quantities:
+            results.append("not_in_cart")
+            continue
+        elif operation.op == "update":
+            quantities[book_id] = operation.quantity
+        else:
+            del quantities[book_id]
+        results.append("ok")
+    return quantities, results
+
+
+def merge_items(items) -> dict[PydanticObjectId, int]:
+    """book_id -> quantity, adding up repeated books."""
+    quantities: dict[PydanticObjectId, int] = {}
+    for item in items:
+        quantities[item.book_id] = quantities.get(item.book_id, 0) + item.quantity
+    return quantities
+
+
+def _raw_items(quantities: dict[PydanticObjectId, int]) -> list[dict[str, Any]]:
+    return [
+        {"book_id": book_id, "quantity": quantity}
+        for book_id, quantity in quantities.items()
+    ]
+
+
+async def _chunked(keys, size: int = 500):
+    chunk = []
+    async for key in keys:
+        chunk.append(key)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
 
 class Cart(Document):
     user_id: PydanticObjectId
     cart_items: list[CartItemSchema] = []
     total_price: int = 0
+    # last change to the items; redis carts get it when they are flushed
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+    # live carts are kept in redis when set, see `use_redis`
+    redis: ClassVar[Optional[Any]] = None
+    redis_ttl: ClassVar[int] = 0
 
     class Settings:
         name = "carts"
+        indexes = ["user_id", "updated_at"]
+
+    @classmethod
+    def use_redis(cls, redis, ttl_seconds: int) -> None:
+        """Keep live carts in redis hashes, written back by `CartWriteBehind`."""
+        cls.redis = redis
+        cls.redis_ttl = ttl_seconds
+
+    @classmethod
+    async def get_by_user(cls, user_id: PydanticObjectId) -> Optional["Cart"]:
+        if cls.redis is None:
+            return await cls.find_one(cls.user_id == user_id)
+
+        raw = await cls.redis.hgetall(cart_key(user_id))
+        if CART_ID_FIELD.encode() not in raw:
+            # not cached, or evicted: mongo holds everything already flushed
+            cart = await cls.find_one(cls.user_id == user_id)
+            if not cart:
+                return None
+            await cart._seed_redis()
+            raw = await cls.redis.hgetall(cart_key(user_id))
+        return cls._from_redis(user_id, raw)
+
+    @classmethod
+    async def create_for_user(
+        cls, user_id: PydanticObjectId, cart_items: list = ()
+    ) -> "Cart":
+        cart = await cls(user_id=user_id, cart_items=list(cart_items)).insert()
+        if cls.redis is not None:
+            await cart._seed_redis()
+        return cart
+
+    @classmethod
+    async def remove_books(cls, book_ids: list[PydanticObjectId]) -> None:
+        """Take the given books out of every cart."""
+        if cls.redis is not None:
+            await cls._remove_books_from_redis(book_ids)
+        await cls.find(In("cart_items.book_id", book_ids)).update(
+            {"$pull": {"cart_items": {"book_id": {"$in": book_ids}}}}
+        )
+
+    @classmethod
+    async def _remove_books_from_redis(cls, book_ids: list[PydanticObjectId]) -> int:
+        # live carts may hold books that were never flushed to mongo
+        book_fields = [str(book_id) for book_id in book_ids]
+        changed = 0
+        async for keys in _chunked(
+            cls.redis.scan_iter(match=f"{CART_KEY_PREFIX}*", count=500)
+        ):
+            for start in range(0, len(book_fields), REMOVE_BOOKS_CHUNK):
+                changed += await cls.redis.eval(
+                    REMOVE_BOOKS_SCRIPT,
+                    len(keys) + 1,
+                    DIRTY_CARTS_KEY,
+                    *keys,
+                    len(CART_KEY_PREFIX),
+                    *book_fields[start : start + REMOVE_BOOKS_CHUNK],
+                )
+        return changed
+
+    @classmethod
+    def _from_redis(cls, user_id: PydanticObjectId, raw: dict[bytes, bytes]) -> "Cart":
+        return cls(
+            id=PydanticObjectId(raw[CART_ID_FIELD.encode()].decode()),
+            user_id=user_id,
+            cart_items=items_from_hash(raw),
+        )
+
+    async def _seed_redis(self) -> None:
+        # HSETNX keeps any newer value written while the cart was being loaded
+        key = cart_key(self.user_id)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hsetnx(key, CART_ID_FIELD, str(self.id))
+        for item in self.cart_items:
+            pipe.hsetnx(key, str(item.book_id), item.quantity)
+        pipe.expire(key, self.redis_ttl)
+        await pipe.execute()
+
+    async def _write_redis(self, command: str, *args) -> None:
+        key = cart_key(self.user_id)
+        pipe = self.redis.pipeline(transaction=True)
+        getattr(pipe, command)(key, *args)
+        pipe.expire(key, self.redis_ttl)
+        pipe.sadd(DIRTY_CARTS_KEY, str(self.user_id))
+        await pipe.execute()
+
+    async def _save_items(self) -> None:
+        self.updated_at = datetime.utcnow()
+        await self.save()
 
     async def add_to_cart(self, *, book_id: PydanticObjectId, quantity: int = 1):
         if not self.cart_items:
@@ -20,10 +236,13 @@ class Cart(Document):
         for item in self.cart_items:
             if item.book_id == book_id:
                 item.quantity += quantity
-                await self.save()
-                return
-        self.cart_items.append(CartItemSchema(book_id=book_id, quantity=quantity))
-        await self.save()
+                break
+        else:
+            self.cart_items.append(CartItemSchema(book_id=book_id, quantity=quantity))
+        if self.redis is not None:
+            await self._write_redis("hincrby", str(book_id), quantity)
+            return
+        await self._save_items()
 
     async def remove_from_cart(self, *, book_id: PydanticObjectId):
         if not self.cart_items:
@@ -31,7 +250,10 @@ class Cart(Document):
         for item in self.cart_items:
             if item.book_id == book_id:
                 self.cart_items.remove(item)
-                await self.save()
+                if self.redis is not None:
+                    await self._write_redis("hdel", str(book_id))
+                    return
+                await self._save_items()
 
     async def update_cart_items(self, *, book_id: PydanticObjectId, quantity: int):
         if not self.cart_items:
@@ -39,11 +261,102 @@ class Cart(Document):
         for item in self.cart_items:
             if item.book_id == book_id:
                 item.quantity = quantity
-                await self.save()
+                if self.redis is not None:
+                    await self._write_redis("hset", str(book_id), quantity)
+                    return
+                await self._save_items()
                 return
 
+    async def apply_operations(
+        self,
+        operations: list[CartOperationSchema],
+        known_books: set[PydanticObjectId],
+        retries: int = 3,
+    ) -> list[str]:
+        """Apply a batch of add/update/remove operations in one atomic write.
+
+        Operations on books outside `known_books` are skipped. Returns one
+        result per operation.
+        """
+        stored = self.cart_items
+        quantities, results = plan_operations(
+            merge_items(stored), operations, known_books
+        )
+        if self.redis is not None:
+            valid = [op for op in operations if op.book_id in known_books]
+            args = [self.redis_ttl, str(self.user_id)]
+            for operation in valid:
+                args += [operation.op, str(operation.book_id), operation.quantity]
+            applied = iter(
+                await self.redis.eval(
+                    APPLY_OPERATIONS_SCRIPT,
+                    2,
+                    cart_key(self.user_id),
+                    DIRTY_CARTS_KEY,
+                    *args,
+                )
+            )
+            results = [
+                next(applied).decode() if result != "book_not_found" else result
+                for result in results
+            ]
+        else:
+            # the update only matches the exact stored array it was planned
+            # against; duplicated items in older carts are merged by the write
+            for _ in range(retries):
+                result = await self.get_motor_collection().update_one(
+                    {
+                        "_id": self.id,
+                        "cart_items": [item.model_dump() for item in stored],
+                    },
+                    {
+                        "$set": {
+                            "cart_items": _raw_items(quantities),
+                            "updated_at": datetime.utcnow(),
+                        }
+                    },
+                )
+                if result.matched_count:
+                    break
+                cart = await Cart.get(self.id)
+                if not cart:
+                    raise CartConflictError()
+                stored = cart.cart_items
+                quantities, results = plan_operations(
+                    merge_items(stored), operations, known_books
+                )
+            else:
+                raise CartConflictError()
+        self.cart_items = [
+            CartItemSchema(book_id=book_id, quantity=quantity)
+            for book_id, quantity in quantities.items()
+        ]
+        return results
+
+    async def delete_cart(self):
+        await self.delete()
+        if self.redis is not None:
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.delete(cart_key(self.user_id))
+            pipe.srem(DIRTY_CARTS_KEY, str(self.user_id))
+            await pipe.execute()
+
     async def calculate_total_price(self):
-        for item in self.cart_items:
-            book = await Book.get(item.book_id)
-            self.total_price += book.price * item.quantity
-        await self.save()
+        if self.redis is None:
+            for item in self.cart_items:
+                book = await Book.get(item.book_id)
+                self.total_price += book.price * item.quantity
+            await self.save()
+            return
+
+        # the total is derived on read, nothing to write back
+        book_ids = [item.book_id for item in self.cart_items]
+        prices = {
+            book.id: book.price
+            for book in await Book.find(In(Book.id, book_ids)).to_list()
+        }
+        self.total_price = sum(
+            prices[item.book_id] * item.quantity
+            for item in self.cart_items
+            if item.book_id in prices
+        )
@@ -0,0 +1,28 @@
+from datetime import datetime
+
+import pymongo
+from beanie import Document
+from pymongo import IndexModel
+
+# facet name -> book field it counts
+FACET_FIELDS = {"genre": "genre", "lanugage": "lanugage", "author": "author_id"}
+
+
+class BookFacet(Document):
+    """Number of books per value of a facet, maintained by `utils.facets`."""
+
+    facet: str
+    value: str
+    books: int
+    # the refresh that wrote `books`, and when that refresh started
+    run_id: str = ""
+    refreshed_at: datetime
+
+    class Settings:
+        name = "book_facets"
+        indexes = [
+            IndexModel(
+                [("facet", pymongo.ASCENDING), ("value", pymongo.ASCENDING)],
+                unique=True,
+            )
+        ]
@@ -3,67 +3,129 @@ from typing import Optional
 from beanie import PydanticObjectId
 from fastapi import APIRouter, Depends, HTTPException, Response, status
 from fastapi.encoders import jsonable_encoder
+from fastapi.requests import Request
 from fastapi.responses import JSONResponse
 
 from models.authors import Author
 from models.users import User
 from schemas.authors import CreateAuthorSchema, OutputAuthorSchema, UpdateAuthorSchema
-from utils.helpers import get_object_or_404
+from utils.catalog import get_fresh_snapshot
+from utils.coalescing import single_flight
+from utils.helpers import error_response, get_object_or_404
+from utils.projections import parse_fields, projection_model
 from utils.security import get_admin_user
+from utils.versions import bump_version, get_validators
 
 router = APIRouter()
 
+AUTHOR_FIELDS = frozenset(OutputAuthorSchema.model_fields)
+
 
 @router.post("/")
 async def create_author(
-    author: CreateAuthorSchema, user: User = Depends(get_admin_user)
+    request: Request, author: CreateAuthorSchema, user: User = Depends(get_admin_user)
 ):
     """Create an author"""
-    await Author(
+    author = await Author(
         first_name=author.first_name.lower(), last_name=author.last_name.lower()
     ).insert()
+    await bump_version(request, "authors", author.id)
     return JSONResponse(status_code=201, content={"message": "Author created"})
 
 
 @router.get("/")
 async def get_authors(
-    first_name: Optional[str] = None, last_name: Optional[str] = None
+    request: Request,
+    first_name: Optional[str] = None,
+    last_name: Optional[str] = None,
+    fields: Optional[str] = None,
 ):
     """Get all authors"""
+    requested = parse_fields(fields, AUTHOR_FIELDS)
+    validators = await get_validators(
+        request, ("authors", None), variant=",".join(requested or ())
+    )
+    if validators.is_not_modified(request):
+        return validators.not_modified_response()
+
+    if not requested and (
+        snapshot := get_fresh_snapshot(request, validators.last_modified)
+    ):
+        return Response(
+            content=snapshot.authors_body(first_name, last_name),
+            media_type="application/json",
+            headers=validators.headers,
+        )
+
     authors = Author.find()
     if first_name:
         authors = authors.find(Author.first_name == first_name.lower())
     if last_name:
         authors = authors.find(Author.last_name == last_name.lower())
 
-    authors = await authors.project(OutputAuthorSchema).to_list()
+    model = projection_model(OutputAuthorSchema, requested) if requested else None
+    authors = await authors.project(model or OutputAuthorSchema).to_list()
     json_encoded = jsonable_encoder(authors)
-    return JSONResponse(status_code=200, content={"authors": json_encoded})
+    return JSONResponse(
+        status_code=200,
+        content={"authors": json_encoded},
+        headers=validators.headers,
+    )
 
 
 @router.get("/{author_id}")
-async def get_author(author_id: PydanticObjectId):
+async def get_author(
+    request: Request, author_id: PydanticObjectId, fields: Optional[str] = None
+):
     """Get an author by id"""
+    requested = parse_fields(fields, AUTHOR_FIELDS)
+    validators = await get_validators(
+        request, ("authors", author_id), variant=",".join(requested or ())
+    )
+    if validators.is_not_modified(request):
+        return validators.not_modified_response()
+
+    if requested:
+        author = await single_flight.do(
+            ("author_detail", author_id, requested),
+            lambda: Author.find_one(
+                Author.id == author_id,
+                projection_model=projection_model(OutputAuthorSchema, requested),
+            ),
+        )
+        if not author:
+            raise error_response(
+                status_code=status.HTTP_404_NOT_FOUND, message="Author not found"
+            )
+        return JSONResponse(
+            status_code=status.HTTP_200_OK,
+            content=jsonable_encoder(author.model_dump()),
+            headers=validators.headers,
+        )
+
     author = await get_object_or_404(Author, author_id)
     return JSONResponse(
         status_code=status.HTTP_200_OK,
         content=OutputAuthorSchema(**author.model_dump(by_alias=True)).model_dump(),
+        headers=validators.headers,
     )
 
 
 @router.delete("/{author_id}")
 async def delete_author(
-    author_id: PydanticObjectId, user: User = Depends(get_admin_user)
+    request: Request, author_id: PydanticObjectId, user: User = Depends(get_admin_user)
 ):
     """Delete an author by id"""
     author = await get_object_or_404(Author, author_id)
 
     await author.delete()
+    await bump_version(request, "authors", author_id)
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
 @router.put("/{author_id}")
 async def update_author(
+    request: Request,
     author_id: PydanticObjectId,
     update_author: UpdateAuthorSchema,
     user: User = Depends(get_admin_user),
@@ -76,6 +138,7 @@ async def update_author(
             exclude_unset=True, exclude_defaults=True, exclude_none=True
         )
     )
+    await bump_version(request, "authors", author_id)
     return JSONResponse(
         status_code=status.HTTP_200_OK,
         content="Author updated",
@@ -1,27 +1,66 @@
-from typing import Annotated
+from typing import Annotated, Optional
 
 import cloudinary
 import cloudinary.uploader
 from beanie import PydanticObjectId
-from fastapi import APIRouter, Depends, File, Form, UploadFile, status
+from beanie.operators import In
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    File,
+    Form,
+    Query,
+    UploadFile,
+    status,
+)
 from fastapi.encoders import jsonable_encoder
+from fastapi.requests import Request
 from fastapi.responses import Response
+from pymongo.errors import DuplicateKeyError
+from starlette.concurrency import run_in_threadpool
 
-from config.settings import settings  # for cloudinary config
+from config.settings import settings
 from models.authors import Author
 from models.books import Book
+from models.carts import Cart
+from models.facets import FACET_FIELDS
 from models.users import User
-from schemas.books import BookCreateSchema, BookDetailOutSchema, BookListOutSchema
+from schemas.books import (
+    BookBulkDeleteSchema,
+    BookCreateSchema,
+    BookDetailOutSchema,
+    BookImageRefSchema,
+    BookListOutSchema,
+)
+from utils.catalog import get_fresh_snapshot
+from utils.coalescing import single_flight
+from utils.compression import negotiate
+from utils.facets import book_facet_values, get_facets, refresh_facets
 from utils.helpers import error_response, get_object_or_404, success_response
+from utils.images import (
+    DECODE_ERRORS,
+    DEFAULT_RENDITION,
+    content_hash,
+    process_image,
+    public_id,
+    unused_image_ids,
+    upload_renditions,
+)
+from utils.projections import parse_fields, projection_model
 from utils.security import get_admin_user
+from utils.trending import record_event
+from utils.versions import bump_version, get_validators
 
 router = APIRouter()
 
-config = cloudinary.config(secure=True)
+BOOK_LIST_FIELDS = frozenset(BookListOutSchema.model_fields)
+BOOK_DETAIL_FIELDS = frozenset(BookDetailOutSchema.model_fields) - {"author_id"}
 
 
 @router.post("/")
 async def create_book(
+    request: Request,
     title: Annotated[str, Form()],
     description: Annotated[str, Form()],
     price: Annotated[int, Form()],
@@ -30,11 +69,18 @@ async def create_book(
     author_id: Annotated[PydanticObjectId, Form()],
     genre: Annotated[str, Form()],
     image: Annotated[UploadFile, File()],
+    background_tasks: BackgroundTasks,
     user: User = Depends(get_admin_user),
 ):
     """Create a book"""
 
     author = await get_object_or_404(Author, author_id)
+    # checked before the image is processed and uploaded
+    if await Book.find_one(Book.isbn == isbn):
+        raise error_response(
+            status_code=status.HTTP_409_CONFLICT,
+            message=f"Book with isbn {isbn} already exists",
+        )
 
     content_type = image.content_type
     if content_type not in ["image/jpeg", "image/png", "image/jpg"]:
@@ -49,7 +95,25 @@ async def create_book(
         )
 
     image_data = await image.read()
-    result = cloudinary.uploader.upload(image_data, folder="book_buy", public_id=title)
+    image_hash = content_hash(image_data)
+    # the same cover was uploaded before, reuse its renditions
+    if existing := await Book.find_one(Book.image_hash == image_hash):
+        images = existing.images
+    else:
+        try:
+            renditions = await process_image(
+                image_data,
+                image_format=settings.IMAGE_FORMAT,
+                quality=settings.IMAGE_QUALITY,
+            )
+        except DECODE_ERRORS:
+            raise error_response(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                message="Image could not be decoded",
+            )
+        images = await upload_renditions(
+            request.app.state.storage, image_hash, renditions
+        )
     schema = BookCreateSchema(
         title=title,
         description=description,
@@ -58,30 +122,125 @@ async def create_book(
         lanugage=lanugage,
         author_id=author_id,
         genre=[genre],
-        image_url=result["secure_url"],
+        image_url=images[DEFAULT_RENDITION],
+        images=images,
+        image_hash=image_hash,
     )
-    await Book(**schema.model_dump()).insert()
+    try:
+        book = await Book(**schema.model_dump()).insert()
+    except DuplicateKeyError:
+        # a concurrent request inserted the same isbn first
+        raise error_response(
+            status_code=status.HTTP_409_CONFLICT,
+            message=f"Book with isbn {isbn} already exists",
+        )
+    await bump_version(request, "books", book.id)
+    background_tasks.add_task(refresh_facets, book_facet_values(book))
     return success_response(status_code=status.HTTP_201_CREATED, message="Book created")
 
 
 @router.get("/")
-async def get_books():
+async def get_books(request: Request, fields: Optional[str] = None):
     """Get all books"""
-    books = await Book.find_all(projection_model=BookListOutSchema).to_list()
+    requested = parse_fields(fields, BOOK_LIST_FIELDS)
+    validators = await get_validators(
+        request, ("books", None), variant=",".join(requested or ())
+    )
+    if validators.is_not_modified(request):
+        return validators.not_modified_response()
+
+    if not requested and (
+        snapshot := get_fresh_snapshot(request, validators.last_modified)
+    ):
+        body, encoding = snapshot.encoded_books_body(
+            negotiate(request.headers.get("accept-encoding")),
+            minimum_size=settings.COMPRESSION_MINIMUM_SIZE,
+        )
+        headers = validators.headers
+        if encoding:
+            headers.update({"Content-Encoding": encoding, "Vary": "Accept-Encoding"})
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    model = projection_model(BookListOutSchema, requested) if requested else None
+    books = await Book.find_all(projection_model=model or BookListOutSchema).to_list()
     json_encoded = jsonable_encoder(books)
     return success_response(
         status_code=status.HTTP_200_OK,
         message=json_encoded,
+        headers=validators.headers,
+    )
+
+
+@router.get("/facets")
+async def get_book_facets(facet: Optional[str] = None):
+    """Get book counts per genre, language and author"""
+    if facet is not None and facet not in FACET_FIELDS:
+        raise error_response(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            message=f"Unknown facet: {facet}",
+        )
+    return success_response(
+        status_code=status.HTTP_200_OK, message=await get_facets(facet)
+    )
+
+
+@router.get("/trending")
+async def get_trending_books(
+    request: Request, limit: Annotated[int, Query(gt=0, le=100)] = 10
+):
+    """Get the books with the most recent views and cart adds"""
+    recorder = getattr(request.app.state, "trending", None)
+    if recorder is None:
+        raise error_response(
+            status_code=status.HTTP_404_NOT_FOUND, message="Trending is disabled"
+        )
+    # extra candidates cover books deleted since they were scored
+    scores = dict(await recorder.top(limit * 2))
+    books = await Book.find(
+        In(Book.id, list(scores)), projection_model=BookListOutSchema
+    ).to_list()
+    trending = sorted(
+        ({**book.model_dump(), "score": scores[book.id]} for book in books),
+        key=lambda book: book["score"],
+        reverse=True,
+    )[:limit]
+    return success_response(
+        status_code=status.HTTP_200_OK, message=jsonable_encoder(trending)
     )
 
 
 @router.get("/{book_id}")
-async def get_book(book_id: PydanticObjectId):
+async def get_book(
+    request: Request, book_id: PydanticObjectId, fields: Optional[str] = None
+):
     """Get a book by id"""
-    book = await get_object_or_404(Book, book_id)
+    requested = parse_fields(fields, BOOK_DETAIL_FIELDS)
+    # the detail embeds the author, so author writes invalidate it as well
+    validators = await get_validators(
+        request,
+        ("books", book_id),
+        ("authors", None),
+        variant=",".join(requested or ()),
+    )
+    if validators.is_not_modified(request):
+        return validators.not_modified_response()
+
+    if not requested and (
+        snapshot := get_fresh_snapshot(request, validators.last_modified)
+    ):
+        body = snapshot.book_body(book_id)
+        if body is None:
+            raise error_response(
+                status_code=status.HTTP_404_NOT_FOUND, message="Book not found"
+            )
+        record_event(request, book_id, "view")
+        return Response(
+            content=body, media_type="application/json", headers=validators.headers
+        )
 
-    book_detail = await book.aggregate(
-        [
+    pipeline = [{"$match": {"_id": book_id}}]
+    if not requested or "author" in requested:
+        pipeline.append(
             {
                 "$lookup": {
                     "from": "authors",
@@ -90,29 +249,96 @@ async def get_book(book_id: PydanticObjectId):
                     "as": "author",
                 }
             }
-        ],
-        projection_model=BookDetailOutSchema,
-    ).to_list(1)
+        )
+    model = projection_model(BookDetailOutSchema, requested) if requested else None
+    # concurrent requests for a hot book share a single aggregation
+    book_detail = await single_flight.do(
+        ("book_detail", book_id, requested),
+        lambda: Book.aggregate(
+            pipeline, projection_model=model or BookDetailOutSchema
+        ).to_list(1),
+    )
+    if not book_detail:
+        raise error_response(
+            status_code=status.HTTP_404_NOT_FOUND, message="Book not found"
+        )
     book_detail = book_detail[0].model_dump(exclude={"author_id"})
     json_encoded = jsonable_encoder(book_detail)
+    # only 200s for books that exist count as views
+    record_event(request, book_id, "view")
 
-    return success_response(status_code=status.HTTP_200_OK, message=json_encoded)
+    return success_response(
+        status_code=status.HTTP_200_OK,
+        message=json_encoded,
+        headers=validators.headers,
+    )
 
 
 @router.delete("/{book_id}")
-async def delete_book(book_id: PydanticObjectId, user: User = Depends(get_admin_user)):
+async def delete_book(
+    request: Request,
+    book_id: PydanticObjectId,
+    background_tasks: BackgroundTasks,
+    user: User = Depends(get_admin_user),
+):
     """Delete a book by id"""
     book = await get_object_or_404(Book, book_id)
 
-    response = cloudinary.uploader.destroy(f"book_buy/{book.title}")
-    if response["result"] == "not found":
-        raise error_response(
-            status_code=status.HTTP_404_NOT_FOUND, message="Book image not found"
+    if book.image_hash is None:
+        # uploaded before renditions existed, stored under the title
+        response = cloudinary.uploader.destroy(f"book_buy/{book.title}")
+        if response["result"] == "not found":
+            raise error_response(
+                status_code=status.HTTP_404_NOT_FOUND, message="Book image not found"
+            )
+    elif not await Book.find_one(
+        Book.image_hash == book.image_hash, Book.id != book.id
+    ):
+        await run_in_threadpool(
+            request.app.state.storage.delete,
+            [public_id(book.image_hash, name) for name in book.images],
         )
     await book.delete()
+    await bump_version(request, "books", book_id)
+    background_tasks.add_task(refresh_facets, book_facet_values(book))
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
+@router.post("/bulk-delete")
+async def bulk_delete_books(
+    request: Request,
+    bulk_delete: BookBulkDeleteSchema,
+    background_tasks: BackgroundTasks,
+    user: User = Depends(get_admin_user),
+):
+    """Delete every book matching the given ids, author and genre"""
+    books = await Book.find(
+        bulk_delete.to_filter(), projection_model=BookImageRefSchema
+    ).to_list()
+    if not books:
+        return success_response(status_code=status.HTTP_200_OK, message={"deleted": 0})
+    book_ids = [book.id for book in books]
+
+    result = await Book.find(In(Book.id, book_ids)).delete()
+    await Cart.remove_books(book_ids)
+    await bump_version(request, "books", *book_ids)
+
+    # covers are shared between books with the same content hash
+    hashes = {book.image_hash for book in books if book.image_hash}
+    still_used = set(
+        await Book.distinct(Book.image_hash, {"image_hash": {"$in": list(hashes)}})
+    )
+    background_tasks.add_task(
+        request.app.state.storage.delete, unused_image_ids(books, still_used)
+    )
+    # any number of values can be affected, so recount everything
+    background_tasks.add_task(refresh_facets)
+
+    return success_response(
+        status_code=status.HTTP_200_OK, message={"deleted": result.deleted_count}
+    )
+
+
 # TODO: Implement update book later on
 @router.put("/{book_id}")
 async def update_book(book_id: PydanticObjectId, user: User = Depends(get_admin_user)):
@@ -2,20 +2,23 @@
 from typing import Annotated
 
 from beanie import PydanticObjectId
-from fastapi import APIRouter, Body, Depends, HTTPException, status
+from fastapi import APIRouter, Body, Depends, HTTPException, Request, status
 from fastapi.responses import JSONResponse, Response
 
 from models.books import Book
-from models.carts import Cart
+from models.carts import Cart, CartConflictError
 from models.users import User
 from schemas.carts import (
+    CartBatchSchema,
+    CartOperationResultSchema,
     CreateCartItemSchema,
     CreateCartSchema,
     CreateCartSchemaInDB,
     OutputCartSchema,
 )
-from utils.helpers import get_object_or_404
+from utils.helpers import error_response, get_object_or_404
 from utils.security import get_current_user
+from utils.trending import record_event
 
 router = APIRouter()
 
@@ -23,11 +26,20 @@ router = APIRouter()
 @router.post("/")
 async def create_cart(cart: CreateCartSchema, user: User = Depends(get_current_user)):
     """Create a new cart"""
-    exists = await Cart.find_one(Cart.user_id == user.id)
+    exists = await Cart.get_by_user(user.id)
     if exists:
         return OutputCartSchema(**exists.model_dump(by_alias=True))
+    book_ids = [item.book_id for item in cart.cart_items]
+    missing = set(book_ids) - await Book.existing_ids(book_ids)
+    if missing:
+        raise error_response(
+            status_code=status.HTTP_404_NOT_FOUND,
+            message=f"Books not found: {', '.join(sorted(map(str, missing)))}",
+        )
     new_cart = CreateCartSchemaInDB(**cart.model_dump(), user_id=user.id)
-    cart_in_db = await Cart(**new_cart.model_dump()).insert()
+    cart_in_db = await Cart.create_for_user(
+        user.id, new_cart.model_dump()["cart_items"]
+    )
     return JSONResponse(
         status_code=status.HTTP_201_CREATED,
         content=OutputCartSchema(**cart_in_db.model_dump(by_alias=True)).model_dump(),
@@ -36,7 +48,9 @@ async def create_cart(cart: CreateCartSchema, user: User = Depends(get_current_u
 
 @router.post("/add-book-to-cart")
 async def add_book_to_cart(
-    cart_item: CreateCartItemSchema, user: User = Depends(get_current_user)
+    request: Request,
+    cart_item: CreateCartItemSchema,
+    user: User = Depends(get_current_user),
 ):
     """Add a book to cart"""
     book = await Book.get(cart_item.book_id)
@@ -44,13 +58,46 @@ async def add_book_to_cart(
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Book not found"
         )
-    cart = await Cart.find_one(Cart.user_id == user.id)
+    cart = await Cart.get_by_user(user.id)
     if not cart:
-        cart = await Cart(user_id=user.id).insert()
+        cart = await Cart.create_for_user(user.id)
     await cart.add_to_cart(book_id=cart_item.book_id, quantity=cart_item.quantity)
+    record_event(request, cart_item.book_id, "cart_add")
     return JSONResponse(status_code=status.HTTP_200_OK, content="cart updated")
 
 
+@router.post("/batch")
+async def batch_update_cart(
+    request: Request, batch: CartBatchSchema, user: User = Depends(get_current_user)
+):
+    """Apply several add/update/remove operations to the cart at once"""
+    known_books = await Book.existing_ids([op.book_id for op in batch.operations])
+    cart = await Cart.get_by_user(user.id)
+    if not cart:
+        cart = await Cart.create_for_user(user.id)
+    try:
+        results = await cart.apply_operations(batch.operations, known_books)
+    except CartConflictError:
+        raise error_response(
+            status_code=status.HTTP_409_CONFLICT,
+            message="Cart was modified concurrently, try again",
+        )
+    for op, result in zip(batch.operations, results):
+        if op.op == "add" and result == "ok":
+            record_event(request, op.book_id, "cart_add")
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            "results": [
+                CartOperationResultSchema(
+                    op=op.op, book_id=op.book_id, result=result
+                ).model_dump(mode="json")
+                for op, result in zip(batch.operations, results)
+            ]
+        },
+    )
+
+
 @router.delete("/remove-book-from-cart")
 async def remove_book_from_cart(
     book_id: Annotated[PydanticObjectId, Body()], user: User = Depends(get_current_user)
@@ -61,7 +108,7 @@ async def remove_book_from_cart(
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Book not found"
         )
-    cart = await Cart.find_one(Cart.user_id == user.id)
+    cart = await Cart.get_by_user(user.id)
     if not cart:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found"
@@ -74,7 +121,7 @@ async def remove_book_from_cart(
 async def update_cart_item(
     cart_item: CreateCartItemSchema, user: User = Depends(get_current_user)
 ):
-    cart = await Cart.find_one(Cart.user_id == user.id)
+    cart = await Cart.get_by_user(user.id)
     if not cart:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found"
@@ -90,7 +137,7 @@ async def update_cart_item(
 
 @router.get("/")
 async def get_cart(user: User = Depends(get_current_user)):
-    cart = await Cart.find_one(Cart.user_id == user.id)
+    cart = await Cart.get_by_user(user.id)
     if not cart:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found"
@@ -101,6 +148,6 @@ async def get_cart(user: User = Depends(get_current_user)):
 
 @router.delete("/")
 async def delete_cart(user: User = Depends(get_current_user)):
-    cart = await Cart.find_one(Cart.user_id == user.id)
-    await cart.delete()
+    cart = await Cart.get_by_user(user.id)
+    await cart.delete_cart()
     return Response(status_code=status.HTTP_204_NO_CONTENT)
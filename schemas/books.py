@@ -1,7 +1,8 @@
 from datetime import datetime
+from typing import Optional
 
 from beanie import PydanticObjectId
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 
 from schemas.authors import OutputAuthorSchema
 
@@ -15,9 +16,11 @@ class BaseBookSchema(BaseModel):
     author_id: PydanticObjectId
     genre: list[str]
     image_url: str
+    images: dict[str, str] = {}
 
 
 class BookCreateSchema(BaseBookSchema):
+    image_hash: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 
@@ -28,3 +31,33 @@ class BookListOutSchema(BaseBookSchema):
 class BookDetailOutSchema(BookListOutSchema):
     created_at: datetime
     author: list[OutputAuthorSchema]
+
+
+class BookImageRefSchema(BaseModel):
+    id: PydanticObjectId = Field(..., alias="_id")
+    title: str
+    images: dict[str, str] = {}
+    image_hash: Optional[str] = None
+
+
+class BookBulkDeleteSchema(BaseModel):
+    ids: list[PydanticObjectId] = []
+    author_id: Optional[PydanticObjectId] = None
+    genre: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_has_filter(self) -> "BookBulkDeleteSchema":
+        if not self.ids and self.author_id is None and self.genre is None:
+            raise ValueError("provide ids, author_id or genre")
+        return self
+
+    def to_filter(self) -> dict:
+        """Mongo filter matching books that satisfy every given criterion."""
+        query = {}
+        if self.ids:
+            query["_id"] = {"$in": self.ids}
+        if self.author_id:
+            query["author_id"] = self.author_id
+        if self.genre:
+            query["genre"] = self.genre
+        return query
@@ -1,5 +1,7 @@
+from typing import Literal
+
 from beanie import PydanticObjectId
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 
 
 class BaseCartItemsSchema(BaseModel):
@@ -21,7 +23,18 @@ class BaseCartSchema(BaseModel):
 
 
 class CreateCartSchema(BaseCartSchema):
-    pass
+    @field_validator("cart_items")
+    @classmethod
+    def merge_repeated_books(
+        cls, cart_items: list[CreateCartItemSchema]
+    ) -> list[CreateCartItemSchema]:
+        merged: dict[PydanticObjectId, CreateCartItemSchema] = {}
+        for item in cart_items:
+            if item.book_id in merged:
+                merged[item.book_id].quantity += item.quantity
+            else:
+                merged[item.book_id] = item.model_copy()
+        return list(merged.values())
 
 
 class CreateCartSchemaInDB(BaseCartSchema):
@@ -31,3 +44,17 @@ class CreateCartSchemaInDB(BaseCartSchema):
 class OutputCartSchema(BaseCartSchema):
     id: PydanticObjectId = Field(..., alias="_id")
     total_price: int
+
+
+class CartOperationSchema(BaseCartItemsSchema):
+    op: Literal["add", "update", "remove"]
+
+
+class CartBatchSchema(BaseModel):
+    operations: list[CartOperationSchema] = Field(..., min_length=1, max_length=100)
+
+
+class CartOperationResultSchema(BaseModel):
+    op: str
+    book_id: PydanticObjectId
+    result: Literal["ok", "book_not_found", "not_in_cart"]
@@ -0,0 +1,60 @@
+import pytest
+from beanie import PydanticObjectId
+from pydantic import ValidationError
+
+from schemas.books import BookBulkDeleteSchema, BookImageRefSchema
+from utils.images import public_id, unused_image_ids
+
+
+def make_ref(title, image_hash=None, images=("small", "large")):
+    return BookImageRefSchema(
+        _id=PydanticObjectId(),
+        title=title,
+        image_hash=image_hash,
+        images={name: f"https://example.com/{name}" for name in images},
+    )
+
+
+def test_bulk_delete_requires_a_filter():
+    with pytest.raises(ValidationError):
+        BookBulkDeleteSchema()
+    with pytest.raises(ValidationError):
+        BookBulkDeleteSchema(ids=[])
+
+
+def test_bulk_delete_filter_combines_criteria():
+    ids = [PydanticObjectId(), PydanticObjectId()]
+    author_id = PydanticObjectId()
+    assert BookBulkDeleteSchema(ids=ids).to_filter() == {"_id": {"$in": ids}}
+    assert BookBulkDeleteSchema(
+        ids=ids, author_id=author_id, genre="fantasy"
+    ).to_filter() == {
+        "_id": {"$in": ids},
+        "author_id": author_id,
+        "genre": "fantasy",
+    }
+    assert BookBulkDeleteSchema(genre="fantasy").to_filter() == {"genre": "fantasy"}
+
+
+def test_unused_image_ids_keeps_shared_covers():
+    shared = make_ref("Shared", image_hash="aaa")
+    shared_twin = make_ref("Shared twin", image_hash="aaa")
+    kept_elsewhere = make_ref("Reprint", image_hash="bbb")
+    legacy = make_ref("Old Title", images=())
+
+    public_ids = unused_image_ids(
+        [shared, shared_twin, kept_elsewhere, legacy], still_used={"bbb"}
+    )
+
+    # the shared cover is removed once, the one still in use is kept
+    assert public_ids == [
+        public_id("aaa", "small"),
+        public_id("aaa", "large"),
+        "book_buy/Old Title",
+    ]
+
+
+def test_unused_image_ids_does_not_mutate_still_used():
+    still_used = {"bbb"}
+    unused_image_ids([make_ref("Shared", image_hash="aaa")], still_used)
+    assert still_used == {"bbb"}
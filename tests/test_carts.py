@@ -0,0 +1,162 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from beanie import PydanticObjectId
+
+from models.carts import (
+    DIRTY_CARTS_KEY,
+    REMOVE_BOOKS_SCRIPT,
+    Cart,
+    cart_key,
+    items_from_hash,
+    merge_items,
+    plan_operations,
+)
+from models.books import Book
+from schemas.carts import CartItemSchema, CartOperationSchema, CreateCartSchema
+from utils.cart_archive import CLAIM_CARTS_SCRIPT, CartArchiver, idle_filter
+
+
+def test_items_from_hash_skips_cart_id():
+    cart_id, book_id = PydanticObjectId(), PydanticObjectId()
+    raw = {b"_id": str(cart_id).encode(), str(book_id).encode(): b"3"}
+    assert items_from_hash(raw) == [{"book_id": book_id, "quantity": 3}]
+
+
+def test_plan_operations_results_per_item():
+    in_cart, new, unknown = PydanticObjectId(), PydanticObjectId(), PydanticObjectId()
+    operations = [
+        CartOperationSchema(op="add", book_id=in_cart, quantity=2),
+        CartOperationSchema(op="update", book_id=new, quantity=5),
+        CartOperationSchema(op="add", book_id=new),
+        CartOperationSchema(op="remove", book_id=unknown),
+        CartOperationSchema(op="remove", book_id=in_cart),
+    ]
+    quantities, results = plan_operations({in_cart: 1}, operations, {in_cart, new})
+    assert results == ["ok", "not_in_cart", "ok", "book_not_found", "ok"]
+    assert quantities == {new: 1}
+
+
+def test_idle_filter_skips_carts_waiting_for_write_behind():
+    cutoff = datetime(2024, 1, 1)
+    assert idle_filter(cutoff) == {"updated_at": {"$lt": cutoff}}
+    user_id = PydanticObjectId()
+    assert idle_filter(cutoff, [user_id]) == {
+        "updated_at": {"$lt": cutoff},
+        "user_id": {"$nin": [user_id]},
+    }
+
+
+class FakeCartRedis:
+    """Just enough of redis to run the cart scripts' logic in memory."""
+
+    def __init__(self, hashes):
+        self.hashes = hashes
+        self.dirty = set()
+
+    async def scan_iter(self, match, count):
+        for key in list(self.hashes):
+            if key.startswith(match.rstrip("*")):
+                yield key
+
+    async def eval(self, script, numkeys, *args):
+        assert script == REMOVE_BOOKS_SCRIPT
+        dirty_key, keys = args[0], args[1:numkeys]
+        prefix_length, fields = args[numkeys], args[numkeys + 1 :]
+        assert dirty_key == DIRTY_CARTS_KEY
+        changed = 0
+        for key in keys:
+            removed = [self.hashes[key].pop(field, None) for field in fields]
+            if any(value is not None for value in removed):
+                self.dirty.add(key[prefix_length:])
+                changed += 1
+        return changed
+
+
+def test_removed_books_leave_live_redis_carts(monkeypatch):
+    deleted, kept = str(PydanticObjectId()), str(PydanticObjectId())
+    first, second = PydanticObjectId(), PydanticObjectId()
+    redis = FakeCartRedis(
+        {
+            cart_key(first): {"_id": "x", deleted: 1, kept: 2},
+            cart_key(second): {"_id": "y", kept: 1},
+        }
+    )
+    monkeypatch.setattr(Cart, "redis", redis)
+    changed = asyncio.run(Cart._remove_books_from_redis([PydanticObjectId(deleted)]))
+    assert changed == 1
+    assert redis.hashes[cart_key(first)] == {"_id": "x", kept: 2}
+    assert redis.hashes[cart_key(second)] == {"_id": "y", kept: 1}
+    # marked dirty, so the write-behind rewrites mongo without the book
+    assert redis.dirty == {str(first)}
+
+
+class FakeBookCollection:
+    def __init__(self, ids):
+        self.ids = ids
+
+    async def distinct(self, key, filter=None, session=None, **kwargs):
+        assert key == "_id"
+        return [doc_id for doc_id in self.ids if doc_id in filter["_id"]["$in"]]
+
+
+def test_existing_book_ids_runs_one_in_query(monkeypatch):
+    known, unknown = PydanticObjectId(), PydanticObjectId()
+    collection = FakeBookCollection([known, PydanticObjectId()])
+    monkeypatch.setattr(Book, "get_motor_collection", lambda: collection)
+    assert asyncio.run(Book.existing_ids([known, unknown, known])) == {known}
+    assert asyncio.run(Book.existing_ids([])) == set()
+
+
+def test_create_cart_merges_repeated_books():
+    book_id = PydanticObjectId()
+    cart = CreateCartSchema(
+        cart_items=[
+            {"book_id": book_id, "quantity": 1},
+            {"book_id": book_id, "quantity": 2},
+        ]
+    )
+    assert [(item.book_id, item.quantity) for item in cart.cart_items] == [(book_id, 3)]
+
+
+def test_merge_items_adds_up_repeated_books():
+    book_id = PydanticObjectId()
+    items = [
+        CartItemSchema(book_id=book_id),
+        CartItemSchema(book_id=book_id, quantity=4),
+    ]
+    assert merge_items(items) == {book_id: 5}
+
+
+class FakeClaimRedis:
+    def __init__(self, hashes, dirty):
+        self.hashes = hashes
+        self.dirty = dirty
+
+    async def eval(self, script, numkeys, *args):
+        assert script == CLAIM_CARTS_SCRIPT
+        dirty_key, keys, user_ids = args[0], args[1:numkeys], args[numkeys:]
+        assert dirty_key == DIRTY_CARTS_KEY
+        claimed = []
+        for key, user_id in zip(keys, user_ids):
+            if user_id in self.dirty:
+                claimed.append(0)
+            else:
+                self.hashes.pop(key, None)
+                claimed.append(1)
+        return claimed
+
+
+def test_archiver_leaves_carts_changed_after_the_batch_was_read():
+    idle, changed = PydanticObjectId(), PydanticObjectId()
+    redis = FakeClaimRedis(
+        {cart_key(idle): {"_id": "x"}, cart_key(changed): {"_id": "y"}},
+        # marked dirty after the batch was read
+        dirty={str(changed)},
+    )
+    archiver = CartArchiver(
+        max_idle=timedelta(days=1), interval=1, batch_size=10, pause=0, redis=redis
+    )
+    batch = [{"user_id": idle}, {"user_id": changed}]
+    assert asyncio.run(archiver._claim(batch)) == [{"user_id": idle}]
+    assert list(redis.hashes) == [cart_key(changed)]
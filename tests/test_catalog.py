@@ -0,0 +1,162 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+
+import pytest
+from beanie import PydanticObjectId, init_beanie
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from models.authors import Author
+from models.books import Book
+from utils.catalog import AuthorRecord, BookRecord, CatalogSnapshot
+
+author_raw = {"_id": PydanticObjectId(), "first_name": "ursula", "last_name": "le guin"}
+book_raw = {
+    "_id": PydanticObjectId(),
+    "title": "The Dispossessed",
+    "isbn": "9780060512750",
+    "price": 20,
+    "description": "An ambiguous utopia",
+    "lanugage": "english",
+    "author_id": author_raw["_id"],
+    "genre": ["fiction"],
+    "image_url": "https://example.com/cover.jpg",
+    "created_at": datetime(2023, 8, 20, 10, 0),
+}
+
+
+def make_snapshot() -> CatalogSnapshot:
+    snapshot = CatalogSnapshot()
+    snapshot.authors[author_raw["_id"]] = AuthorRecord(author_raw)
+    snapshot.books[book_raw["_id"]] = BookRecord(book_raw)
+    return snapshot
+
+
+def test_books_body():
+    body = json.loads(make_snapshot().books_body())
+    assert body["status"] == "success"
+    assert body["detail"][0]["_id"] == str(book_raw["_id"])
+    assert body["detail"][0]["title"] == "The Dispossessed"
+
+
+def test_book_body_embeds_author():
+    snapshot = make_snapshot()
+    body = json.loads(snapshot.book_body(book_raw["_id"]))
+    assert "author_id" not in body["detail"]
+    assert body["detail"]["created_at"] == "2023-08-20T10:00:00"
+    assert body["detail"]["author"] == [
+        {"first_name": "ursula", "last_name": "le guin", "id": str(author_raw["_id"])}
+    ]
+    assert snapshot.book_body(PydanticObjectId()) is None
+
+
+def test_authors_body_filters():
+    snapshot = make_snapshot()
+    assert len(json.loads(snapshot.authors_body(first_name="Ursula"))["authors"]) == 1
+    assert json.loads(snapshot.authors_body(last_name="tolkien")) == {"authors": []}
+
+
+def test_memory_footprint():
+    assert make_snapshot().memory_footprint() > CatalogSnapshot().memory_footprint()
+
+
+@pytest.mark.skipif(
+    not os.getenv("MONGO_REPLSET_URI"),
+    reason="needs a replica set, e.g. mongod --replSet rs0 then rs.initiate()",
+)
+def test_snapshot_follows_change_streams():
+    async def run():
+        client = AsyncIOMotorClient(os.environ["MONGO_REPLSET_URI"])
+        await client.drop_database("book_buy_test_catalog")
+        await init_beanie(
+            database=client["book_buy_test_catalog"], document_models=[Author, Book]
+        )
+        snapshot = CatalogSnapshot(max_staleness=1)
+        await snapshot.start()
+        try:
+            author = await Author(first_name="ursula", last_name="le guin").insert()
+            for _ in range(50):
+                if snapshot.is_fresh and author.id in snapshot.authors:
+                    break
+                await asyncio.sleep(0.1)
+            assert author.id in snapshot.authors
+
+            await author.delete()
+            for _ in range(50):
+                if author.id not in snapshot.authors:
+                    break
+                await asyncio.sleep(0.1)
+            assert author.id not in snapshot.authors
+        finally:
+            await snapshot.stop()
+            await client.drop_database("book_buy_test_catalog")
+
+    asyncio.run(run())
+
+
+class FakeStream:
+    def __init__(self, changes):
+        self.changes = list(changes)
+        self.alive = True
+        self.resume_token = {"_data": "token"}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def try_next(self):
+        if not self.changes:
+            await asyncio.Event().wait()
+        return self.changes.pop(0)
+
+
+class FakeCollection:
+    """Serves one list of documents and one list of changes per watch()."""
+
+    def __init__(self, rounds):
+        self.rounds = list(rounds)
+        self.current = ([], [])
+
+    def watch(self, **kwargs):
+        self.current = self.rounds.pop(0)
+        return FakeStream(self.current[1])
+
+    async def _iterate(self):
+        for raw in self.current[0]:
+            yield raw
+
+    def find(self):
+        return self._iterate()
+
+
+def test_follower_resyncs_after_unusable_change(monkeypatch):
+    monkeypatch.setattr("utils.catalog.RETRY_DELAY", 0)
+    other = {"_id": PydanticObjectId(), "first_name": "n. k.", "last_name": "jemisin"}
+    broken = {"operationType": "insert", "fullDocument": {"_id": PydanticObjectId()}}
+    collection = FakeCollection([([author_raw], [broken]), ([author_raw, other], [])])
+
+    class FakeAuthor:
+        class Settings:
+            name = "authors"
+
+        @staticmethod
+        def get_motor_collection():
+            return collection
+
+    async def run():
+        snapshot = CatalogSnapshot()
+        task = asyncio.create_task(snapshot._follow(FakeAuthor))
+        for _ in range(100):
+            if len(snapshot.authors) == 2:
+                break
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return snapshot
+
+    snapshot = asyncio.run(run())
+    assert set(snapshot.authors) == {author_raw["_id"], other["_id"]}
+    assert snapshot._resyncs == 2
@@ -0,0 +1,83 @@
+import asyncio
+
+from beanie import PydanticObjectId
+
+from models.authors import Author
+from utils import coalescing
+from utils.coalescing import BatchLoader, SingleFlight
+
+
+def test_single_flight_shares_overlapping_calls():
+    flight = SingleFlight()
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    async def main():
+        first = await asyncio.gather(*(flight.do("book", fetch) for _ in range(5)))
+        second = await flight.do("book", fetch)
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first == [1] * 5
+    # nothing is cached once the call has returned
+    assert second == 2
+    assert (flight.requests, flight.executions) == (6, 2)
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        # hold the query open so later loads can join it
+        await asyncio.sleep(0.01)
+        for doc in self.docs:
+            yield doc
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = {doc["_id"]: doc for doc in docs}
+        self.queries = []
+
+    def find(self, query):
+        ids = query["_id"]["$in"]
+        self.queries.append(ids)
+        return FakeCursor([self.docs[doc_id] for doc_id in ids if doc_id in self.docs])
+
+
+def test_batch_loader_merges_ticks_and_joins_in_flight_queries(monkeypatch):
+    first, second, missing = PydanticObjectId(), PydanticObjectId(), PydanticObjectId()
+    collection = FakeCollection(
+        [
+            {"_id": first, "first_name": "a", "last_name": "b"},
+            {"_id": second, "first_name": "c", "last_name": "d"},
+        ]
+    )
+    monkeypatch.setattr(Author, "get_motor_collection", lambda: collection)
+    monkeypatch.setattr(coalescing, "parse_obj", lambda model, raw: dict(raw))
+    loader = BatchLoader(Author)
+
+    async def main():
+        same_tick = asyncio.gather(
+            loader.load(first), loader.load(second), loader.load(missing)
+        )
+        await asyncio.sleep(0.001)
+        # the first query is still running: this joins it
+        later = await loader.load(first)
+        return await same_tick, later
+
+    (a, b, none), later = asyncio.run(main())
+    assert (a["first_name"], b["first_name"], none) == ("a", "c", None)
+    assert later == a and later is not a
+    assert len(collection.queries) == 1
+    assert (loader.requests, loader.queries) == (4, 1)
+    assert not loader._in_flight
@@ -0,0 +1,84 @@
+import asyncio
+import gzip
+import zlib
+
+from starlette.responses import JSONResponse, Response, StreamingResponse
+
+from utils.compression import CompressionMiddleware, compress, negotiate
+
+
+def run(app, accept_encoding="gzip"):
+    messages = []
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "headers": [(b"accept-encoding", accept_encoding.encode())],
+    }
+    asyncio.run(CompressionMiddleware(app, minimum_size=100)(scope, receive, send))
+    headers = {k.decode(): v.decode() for k, v in messages[0]["headers"]}
+    chunks = [message.get("body", b"") for message in messages[1:]]
+    return headers, b"".join(chunks), chunks
+
+
+def test_negotiate():
+    assert negotiate(None) is None
+    assert negotiate("gzip") == "gzip"
+    assert negotiate("gzip;q=0, identity") is None
+    assert negotiate("gzip, br") == "br"
+    assert negotiate("*") == "zstd"
+    assert negotiate("gzip;q=1.0, br;q=0.1") == "gzip"
+    assert negotiate("gzip;q=0.5, br;q=0.5, zstd;q=0.2") == "br"
+
+
+def test_small_body_is_not_compressed():
+    headers, body, _ = run(JSONResponse({"ok": True}))
+    assert "content-encoding" not in headers
+    assert body == b'{"ok":true}'
+
+
+def test_large_body_is_compressed():
+    payload = {"books": ["x" * 50] * 20}
+    headers, body, _ = run(JSONResponse(payload))
+    assert headers["content-encoding"] == "gzip"
+    assert "content-length" not in headers
+    assert gzip.decompress(body) == JSONResponse(payload).body
+
+
+def test_streamed_body_is_compressed_chunk_by_chunk():
+    chunks = [b'{"a":"' + b"y" * 60 + b'"}\n' for _ in range(10)]
+
+    async def stream():
+        for chunk in chunks:
+            yield chunk
+
+    headers, body, sent = run(
+        StreamingResponse(stream(), media_type="application/json")
+    )
+    assert headers["content-encoding"] == "gzip"
+    assert len(sent) > 1
+    assert gzip.decompress(body) == b"".join(chunks)
+
+    # every chunk is flushed, so what arrived so far decodes to the input so far
+    decompressor = zlib.decompressobj(31)
+    for chunk, sent_chunk in zip(chunks, sent):
+        assert decompressor.decompress(sent_chunk) == chunk
+
+
+def test_precompressed_and_binary_bodies_pass_through():
+    body = compress("gzip", b"x" * 500)
+    headers, sent_body, _ = run(
+        Response(
+            body, media_type="application/json", headers={"Content-Encoding": "gzip"}
+        )
+    )
+    assert sent_body == body
+    _, sent_body, _ = run(Response(b"\x89PNG" * 100, media_type="image/png"))
+    assert sent_body == b"\x89PNG" * 100
@@ -0,0 +1,37 @@
+from datetime import datetime, timezone
+
+from beanie import PydanticObjectId
+
+from utils.facets import facet_pipeline
+
+
+def test_full_refresh_counts_every_book():
+    pipeline = facet_pipeline("run", datetime.now(timezone.utc))
+    assert "$facet" in pipeline[0]
+    assert pipeline[-1]["$merge"]["on"] == ["facet", "value"]
+
+
+def test_incremental_refresh_only_recounts_given_values():
+    author_id = PydanticObjectId()
+    values = {"genre": ["fantasy"], "lanugage": ["en"], "author": [author_id]}
+    match, facet = facet_pipeline("run", datetime.now(timezone.utc), values)[:2]
+    assert {"genre": {"$in": ["fantasy"]}} in match["$match"]["$or"]
+    genre = facet["$facet"]["genre"]
+    # other genres of the matched books must not be recounted from a subset
+    assert genre[:2] == [
+        {"$unwind": "$genre"},
+        {"$match": {"genre": {"$in": ["fantasy"]}}},
+    ]
+    assert facet["$facet"]["author"][0] == {
+        "$match": {"author_id": {"$in": [author_id]}}
+    }
+
+
+def test_merge_never_overwrites_a_newer_run():
+    merge = facet_pipeline("run", datetime.now(timezone.utc))[-1]["$merge"]
+    (update,) = merge["whenMatched"]
+    assert set(update["$set"]) == {"books", "run_id", "refreshed_at"}
+    for field, value in update["$set"].items():
+        newer, new_value, old_value = value["$cond"]
+        assert newer == {"$gte": ["$$new.refreshed_at", "$refreshed_at"]}
+        assert (new_value, old_value) == (f"$$new.{field}", f"${field}")
@@ -0,0 +1,38 @@
+import json
+
+from utils.idempotency import decode_response, encode_response, fingerprint, storage_key
+
+
+def make_scope(authorization=b"Bearer a", path="/books/"):
+    return {
+        "type": "http",
+        "method": "POST",
+        "path": path,
+        "headers": [(b"authorization", authorization)],
+    }
+
+
+def test_storage_key_is_scoped_to_caller_and_route():
+    key = storage_key(make_scope(), "abc")
+    assert key == storage_key(make_scope(), "abc")
+    assert key != storage_key(make_scope(authorization=b"Bearer b"), "abc")
+    assert key != storage_key(make_scope(path="/users/register"), "abc")
+
+
+def test_fingerprint_ignores_multipart_boundary():
+    first = b"--aaa\r\ncontent\r\n--aaa--"
+    retry = b"--bbb\r\ncontent\r\n--bbb--"
+    assert fingerprint(first, "multipart/form-data; boundary=aaa") == fingerprint(
+        retry, "multipart/form-data; boundary=bbb"
+    )
+    assert fingerprint(b'{"a":1}') != fingerprint(b'{"a":2}')
+
+
+def test_stored_response_round_trips():
+    headers = [(b"content-type", b"application/json")]
+    record = encode_response("f", 201, headers, b'{"status":"success"}')
+    response = decode_response(json.loads(record))
+    assert response.status_code == 201
+    assert response.body == b'{"status":"success"}'
+    assert (b"content-type", b"application/json") in response.raw_headers
+    assert (b"idempotent-replayed", b"true") in response.raw_headers
@@ -0,0 +1,59 @@
+import os
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from utils.images import (
+    DECODE_ERRORS,
+    RENDITION_SIZES,
+    content_hash,
+    public_id,
+    render,
+)
+from utils.storage import LocalStorage
+
+
+def make_png(size=(900, 1200)) -> bytes:
+    out = BytesIO()
+    Image.new("RGBA", size, (10, 120, 200, 255)).save(out, "PNG")
+    return out.getvalue()
+
+
+def test_render_fits_every_size():
+    renditions = render(make_png(), RENDITION_SIZES, "webp", 80)
+    assert [rendition.name for rendition in renditions] == list(RENDITION_SIZES)
+    for rendition in renditions:
+        size = RENDITION_SIZES[rendition.name]
+        assert max(rendition.width, rendition.height) == size
+        assert Image.open(BytesIO(rendition.data)).size == (
+            rendition.width,
+            rendition.height,
+        )
+
+
+def test_render_jpeg_drops_alpha():
+    (rendition,) = render(make_png(), {"small": 100}, "jpeg", 70)
+    assert rendition.extension == "jpg"
+    assert Image.open(BytesIO(rendition.data)).mode == "RGB"
+
+
+@pytest.mark.parametrize(
+    "data",
+    [make_png()[: len(make_png()) // 2], b"not an image", b""],
+    ids=["truncated", "garbage", "empty"],
+)
+def test_render_rejects_undecodable_uploads(data):
+    with pytest.raises(DECODE_ERRORS):
+        render(data, RENDITION_SIZES, "webp", 80)
+
+
+def test_local_storage_roundtrip(tmp_path):
+    storage = LocalStorage(root=str(tmp_path), base_url="/media/")
+    image_hash = content_hash(b"cover")
+    url = storage.upload(b"data", public_id(image_hash, "small"), "webp")
+    assert url == f"/media/book_buy/{image_hash}/small.webp"
+    assert os.path.exists(tmp_path / "book_buy" / image_hash / "small.webp")
+
+    storage.delete([public_id(image_hash, "small"), public_id("missing", "small")])
+    assert not os.path.exists(tmp_path / "book_buy" / image_hash / "small.webp")
@@ -0,0 +1,93 @@
+import asyncio
+
+from utils.limiter import AIMDLimiter, LoadSheddingMiddleware, classify
+
+
+def scope(path, method="GET", headers=()):
+    return {"type": "http", "path": path, "method": method, "headers": list(headers)}
+
+
+def test_classify():
+    assert classify(scope("/healthcheck")) is None
+    assert classify(scope("/carts/", "POST")) == "high"
+    assert classify(scope("/books/")) == "low"
+    assert classify(scope("/books/", headers=[(b"authorization", b"Bearer x")])) == (
+        "normal"
+    )
+    assert classify(scope("/books/", "POST")) == "normal"
+
+
+def test_low_priority_is_shed_first():
+    limiter = AIMDLimiter(initial=10, minimum=1)
+    for _ in range(6):
+        assert limiter.try_acquire("low")
+    assert not limiter.try_acquire("low")
+    assert limiter.try_acquire("high")
+    assert limiter.shed["low"] == 1
+
+
+def test_limit_adapts_to_latency():
+    limiter = AIMDLimiter(initial=10, minimum=5, target_latency=0.1)
+    limiter.try_acquire("high")
+    limiter.release(0.5)
+    assert limiter.limit == 9
+    # a burst of slow responses only backs off once per target latency
+    limiter.try_acquire("high")
+    limiter.release(0.5)
+    assert limiter.limit == 9
+
+    limiter.try_acquire("high")
+    limiter.release(0.01)
+    assert limiter.limit > 9
+    assert limiter.in_flight == 0
+
+
+def test_slow_route_uses_its_own_target():
+    limiter = AIMDLimiter(initial=10, minimum=5, target_latency=0.1)
+    limiter.try_acquire("normal")
+    limiter.release(1.0, target_latency=2.0)
+    assert limiter.limit > 10
+
+
+def run_middleware(middleware, request_scope):
+    sent = []
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(middleware(request_scope, receive, send))
+    return sent
+
+
+def test_middleware_sheds_with_retry_after():
+    called = False
+
+    async def app(scope, receive, send):
+        nonlocal called
+        called = True
+
+    limiter = AIMDLimiter(initial=1, minimum=1)
+    limiter.try_acquire("high")
+    middleware = LoadSheddingMiddleware(app, limiter, retry_after=3)
+    sent = run_middleware(middleware, scope("/carts/", "POST"))
+
+    assert not called
+    assert sent[0]["status"] == 503
+    assert (b"retry-after", b"3") in sent[0]["headers"]
+    assert limiter.shed["high"] == 1
+
+
+def test_middleware_measures_time_to_first_byte():
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        # a slow client draining the body
+        await asyncio.sleep(0.2)
+        await send({"type": "http.response.body", "body": b""})
+
+    limiter = AIMDLimiter(initial=10, minimum=1, target_latency=0.1)
+    run_middleware(LoadSheddingMiddleware(app, limiter), scope("/carts/"))
+    assert limiter.limit > 10
+    assert limiter.in_flight == 0
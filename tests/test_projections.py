@@ -0,0 +1,28 @@
+import pytest
+from fastapi import HTTPException
+
+from schemas.books import BookListOutSchema
+from utils.projections import parse_fields, projection_model
+
+ALLOWED = frozenset(BookListOutSchema.model_fields)
+
+
+def test_parse_fields():
+    assert parse_fields(None, ALLOWED) is None
+    assert parse_fields("price, title,,title", ALLOWED) == ("price", "title")
+
+
+def test_parse_fields_rejects_unknown():
+    with pytest.raises(HTTPException) as exc:
+        parse_fields("title,hashed_password", ALLOWED)
+    assert exc.value.status_code == 400
+
+
+def test_projection_model_is_cached_and_keeps_id():
+    model = projection_model(BookListOutSchema, ("price", "title"))
+    assert model is projection_model(BookListOutSchema, ("price", "title"))
+    assert set(model.model_fields) == {"id", "price", "title"}
+    book = model.model_validate(
+        {"_id": "64e1f0c2a1b2c3d4e5f60718", "price": 10, "title": "Dune"}
+    )
+    assert str(book.model_dump(by_alias=True)["_id"]) == "64e1f0c2a1b2c3d4e5f60718"
@@ -0,0 +1,67 @@
+import asyncio
+from types import SimpleNamespace
+
+from utils import readiness
+from utils.limiter import classify
+from utils.readiness import PoolListener, Readiness, exercise_models
+
+
+def test_hot_models_can_be_exercised():
+    exercise_models()
+
+
+def test_pool_listener_tracks_open_and_checked_out():
+    listener = PoolListener()
+    listener.connection_created(None)
+    listener.connection_created(None)
+    listener.connection_checked_out(None)
+    assert (listener.open, listener.checked_out) == (2, 1)
+    listener.connection_checked_in(None)
+    listener.connection_closed(None)
+    assert (listener.open, listener.checked_out) == (1, 0)
+
+
+def test_readiness_is_never_shed():
+    assert classify({"path": "/readiness", "method": "GET", "headers": []}) is None
+
+
+class FakeMongo:
+    """Opens at most two connections per round, like pymongo's maxConnecting."""
+
+    def __init__(self, listener):
+        self.listener = listener
+        self.admin = self
+        self.opened_this_round = 0
+
+    async def command(self, name):
+        if self.opened_this_round < 2:
+            self.opened_this_round += 1
+            self.listener.connection_created(None)
+        await asyncio.sleep(0)
+        self.opened_this_round = 0
+
+
+class FakeRedis:
+    def __init__(self):
+        self.connection_pool = SimpleNamespace(
+            _created_connections=0, _in_use_connections=set(), max_connections=None
+        )
+
+    async def ping(self):
+        self.connection_pool._created_connections += 1
+
+
+def test_not_warm_until_the_mongo_pool_is_full(monkeypatch):
+    listener = PoolListener()
+    monkeypatch.setattr(readiness, "mongo_pool", listener)
+    monkeypatch.setattr(readiness, "WARM_UP_RETRY_DELAY", 0)
+    probe = Readiness(
+        FakeMongo(listener),
+        FakeRedis(),
+        mongo_pool_size=5,
+        redis_pool_size=2,
+        lag_interval=1,
+    )
+    asyncio.run(probe._warm_up())
+    assert probe.warm
+    assert listener.open >= 5
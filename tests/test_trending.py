@@ -0,0 +1,23 @@
+from beanie import PydanticObjectId
+
+from utils.trending import TrendingRecorder, bucket_key, bucket_weights
+
+
+def test_bucket_weights_decay_with_age():
+    weights = bucket_weights(now=7200.5, bucket_seconds=3600, buckets=3, decay=0.5)
+    assert weights == {bucket_key(2): 1.0, bucket_key(1): 0.5, bucket_key(0): 0.25}
+
+
+def test_recorder_bounds_buffered_books():
+    recorder = TrendingRecorder(
+        redis=None, flush_interval=1, bucket_seconds=60, buckets=2, max_pending=2
+    )
+    first, second, third = PydanticObjectId(), PydanticObjectId(), PydanticObjectId()
+    recorder.record(first, "view")
+    recorder.record(second, "cart_add")
+    recorder.record(third, "view")
+    # books already buffered keep counting once the bound is reached
+    recorder.record(first, "view")
+    assert recorder.stats()["pending"] == 2
+    assert recorder.stats()["dropped"] == 1
+    assert recorder._pending == {str(first): 2, str(second): 5}
@@ -0,0 +1,63 @@
+from datetime import datetime, timezone
+
+from fastapi.requests import Request
+
+from utils.versions import CatalogValidators, build_etag
+
+
+def make_request(headers: dict[str, str]) -> Request:
+    return Request(
+        {
+            "type": "http",
+            "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+        }
+    )
+
+
+validators = CatalogValidators(
+    etag='W/"books.3"',
+    last_modified=datetime(2023, 8, 20, 10, 0, tzinfo=timezone.utc),
+)
+
+
+def test_if_none_match():
+    assert validators.is_not_modified(make_request({"If-None-Match": 'W/"books.3"'}))
+    assert not validators.is_not_modified(
+        make_request({"If-None-Match": 'W/"books.2"'})
+    )
+
+
+def test_if_none_match_takes_precedence():
+    request = make_request(
+        {
+            "If-None-Match": 'W/"books.2"',
+            "If-Modified-Since": "Sun, 20 Aug 2023 11:00:00 GMT",
+        }
+    )
+    assert not validators.is_not_modified(request)
+
+
+def test_if_modified_since():
+    assert validators.is_not_modified(
+        make_request({"If-Modified-Since": "Sun, 20 Aug 2023 10:00:00 GMT"})
+    )
+    assert not validators.is_not_modified(
+        make_request({"If-Modified-Since": "Sun, 20 Aug 2023 09:59:59 GMT"})
+    )
+    assert not validators.is_not_modified(make_request({"If-Modified-Since": "junk"}))
+
+
+def test_not_modified_response_headers():
+    response = validators.not_modified_response()
+    assert response.status_code == 304
+    assert response.headers["etag"] == 'W/"books.3"'
+    assert response.headers["last-modified"] == "Sun, 20 Aug 2023 10:00:00 GMT"
+
+
+def test_build_etag_includes_epoch():
+    fields = ["books", "books:64e1f0c2a1b2c3d4e5f60718"]
+    before_flush = build_etag(b"a1b2c3", fields, [b"1", b"1"])
+    assert before_flush == 'W/"a1b2c3:books.1-books:64e1f0c2a1b2c3d4e5f60718.1"'
+    # same counters under a new epoch, e.g. after redis lost the hash
+    assert build_etag(b"d4e5f6", fields, [b"1", b"1"]) != before_flush
+    assert build_etag(b"a1b2c3", fields, [b"1", b"1"], "price,title") != before_flush
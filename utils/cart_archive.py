@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Any, Optional
+
+import bson
+from pymongo import ReplaceOne
+
+from models.carts import DIRTY_CARTS_KEY, Cart, cart_key
+from utils import metrics
+
+if TYPE_CHECKING:
+    import aioredis
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_COLLECTION = "carts_archive"
+
+# deletes each cart hash unless the cart is waiting for the write-behind;
+# returns 1 per deleted cart and 0 per cart left alone
+CLAIM_CARTS_SCRIPT = """
+local claimed = {}
+for i = 2, #KEYS do
+    if redis.call("SISMEMBER", KEYS[1], ARGV[i - 1]) == 1 then
+        table.insert(claimed, 0)
+    else
+        redis.call("DEL", KEYS[i])
+        table.insert(claimed, 1)
+    end
+end
+return claimed
+"""
+
+
+def idle_filter(cutoff: datetime, skip_user_ids: list[Any] = ()) -> dict[str, Any]:
+    """Carts last changed before `cutoff`, except those of `skip_user_ids`."""
+    query = {"updated_at": {"$lt": cutoff}}
+    if skip_user_ids:
+        query["user_id"] = {"$nin": list(skip_user_ids)}
+    return query
+
+
+class CartArchiver:
+    """Moves carts idle for longer than `max_idle` into `carts_archive`.
+
+    Carts are copied with upserts and then deleted only if still idle, so a
+    run that dies halfway, or several workers running at once, never lose a
+    cart. Batches are separated by `pause` seconds to keep the load on Mongo
+    low while requests are being served.
+    """
+
+    def __init__(
+        self,
+        max_idle: timedelta,
+        interval: float,
+        batch_size: int,
+        pause: float,
+        redis: Optional["aioredis.Redis"] = None,
+    ):
+        self.max_idle = max_idle
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        # set when carts live in redis, see `Cart.use_redis`
+        self.redis = redis
+        self._task = None
+        self._last_run: dict[str, Any] = {}
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+        metrics.register("cart_archive", self.stats)
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        metrics.unregister("cart_archive")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.archive()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Archiving carts failed")
+            await asyncio.sleep(self.interval)
+
+    async def archive(self) -> dict[str, Any]:
+        """Archive every idle cart and return what was reclaimed."""
+        started = time.monotonic()
+        collection = Cart.get_motor_collection()
+        archive = collection.database[ARCHIVE_COLLECTION]
+        # carts from before `updated_at` get a full idle period from now
+        await collection.update_many(
+            {"updated_at": {"$exists": False}},
+            {"$set": {"updated_at": datetime.utcnow()}},
+        )
+
+        cutoff = datetime.utcnow() - self.max_idle
+        carts = reclaimed_bytes = 0
+        while True:
+            skip = []
+            if self.redis is not None:
+                # changes still waiting for the write-behind are not idle
+                skip = [
+                    bson.ObjectId(user_id.decode())
+                    for user_id in await self.redis.smembers(DIRTY_CARTS_KEY)
+                ]
+            batch = await collection.find(idle_filter(cutoff, skip)).to_list(
+                self.batch_size
+            )
+            if not batch:
+                break
+            full = len(batch) == self.batch_size
+            await archive.bulk_write(
+                [ReplaceOne({"_id": cart["_id"]}, cart, upsert=True) for cart in batch],
+                ordered=False,
+            )
+            if self.redis is not None:
+                batch = await self._claim(batch)
+            ids = [cart["_id"] for cart in batch]
+            await collection.delete_many({"_id": {"$in": ids}, **idle_filter(cutoff)})
+            # changed since it was read: stays live, the archived copy is stale
+            kept = set(await collection.distinct("_id", {"_id": {"$in": ids}}))
+            archived = [cart for cart in batch if cart["_id"] not in kept]
+            carts += len(archived)
+            reclaimed_bytes += sum(len(bson.encode(cart)) for cart in archived)
+            if not full:
+                break
+            await asyncio.sleep(self.pause)
+
+        self._last_run = {
+            "archived": carts,
+            "reclaimed_bytes": reclaimed_bytes,
+            "duration_seconds": round(time.monotonic() - started, 3),
+            "finished_at": datetime.utcnow().isoformat(),
+        }
+        metrics.inc("carts_archived", carts)
+        logger.info(
+            "Archived %d idle carts, %d bytes reclaimed", carts, reclaimed_bytes
+        )
+        return self._last_run
+
+    async def _claim(self, batch: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """Drop the redis hashes of carts still clean and return those carts.
+
+        The dirty check and the delete run in one script, so a change made
+        after the batch was read keeps its cart live.
+        """
+        claimed = await self.redis.eval(
+            CLAIM_CARTS_SCRIPT,
+            len(batch) + 1,
+            DIRTY_CARTS_KEY,
+            *(cart_key(cart["user_id"]) for cart in batch),
+            *(str(cart["user_id"]) for cart in batch),
+        )
+        return [cart for cart, ok in zip(batch, claimed) if ok]
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "max_idle_days": self.max_idle.days,
+            "interval_seconds": self.interval,
+            "last_run": self._last_run,
+        }
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import TYPE_CHECKING, Any
+
+from beanie import PydanticObjectId
+from pymongo import UpdateOne
+
+from models.carts import CART_ID_FIELD, DIRTY_CARTS_KEY, Cart, cart_key, items_from_hash
+from utils import metrics
+
+if TYPE_CHECKING:
+    import aioredis
+
+logger = logging.getLogger(__name__)
+
+
+class CartWriteBehind:
+    """Flushes redis carts marked dirty to the `carts` collection in batches.
+
+    Dirty user ids live in a redis set and are only taken with SPOP, so
+    several workers can flush side by side and a crashed worker loses
+    nothing that redis kept. What can be lost is bounded by redis
+    persistence plus one `interval`.
+    """
+
+    def __init__(self, redis: "aioredis.Redis", interval: float, batch_size: int):
+        self.redis = redis
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task = None
+        self._flushed = 0
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+        metrics.register("cart_write_behind", self.stats)
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        # one last pass so a clean shutdown loses nothing
+        while await self.flush() == self.batch_size:
+            pass
+        metrics.unregister("cart_write_behind")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                while await self.flush() == self.batch_size:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Flushing carts failed")
+
+    async def flush(self) -> int:
+        """Write one batch of dirty carts and return how many were taken."""
+        user_ids = await self.redis.spop(DIRTY_CARTS_KEY, self.batch_size)
+        if not user_ids:
+            return 0
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.hgetall(cart_key(user_id.decode()))
+        carts = await pipe.execute()
+
+        operations = []
+        updated_at = datetime.utcnow()
+        for raw in carts:
+            cart_id = raw.get(CART_ID_FIELD.encode())
+            if cart_id is None:
+                # deleted, or evicted after the write: nothing to map it to
+                continue
+            operations.append(
+                UpdateOne(
+                    {"_id": PydanticObjectId(cart_id.decode())},
+                    {
+                        "$set": {
+                            "cart_items": items_from_hash(raw),
+                            "updated_at": updated_at,
+                        }
+                    },
+                )
+            )
+        try:
+            if operations:
+                await Cart.get_motor_collection().bulk_write(operations, ordered=False)
+        except Exception:
+            # put them back so the next pass retries
+            await self.redis.sadd(DIRTY_CARTS_KEY, *user_ids)
+            raise
+        self._flushed += len(operations)
+        metrics.inc("carts_flushed", len(operations))
+        return len(user_ids)
+
+    def stats(self) -> dict[str, Any]:
+        return {"flushed": self._flushed, "interval_seconds": self.interval}
@@ -0,0 +1,291 @@
+import asyncio
+import json
+import logging
+import sys
+import time
+from datetime import datetime
+from typing import Any, Optional
+
+from beanie import PydanticObjectId
+from fastapi.encoders import jsonable_encoder
+from pymongo.errors import OperationFailure, PyMongoError
+
+from models.authors import Author
+from models.books import Book
+from schemas.authors import OutputAuthorSchema
+from schemas.books import BookListOutSchema
+from utils import metrics
+from utils.compression import compress
+
+logger = logging.getLogger(__name__)
+
+# ChangeStreamHistoryLost, InvalidResumeToken, ChangeStreamFatalError
+RESUME_TOKEN_LOST_CODES = {286, 260, 280}
+# seconds to wait before reopening a failed change stream
+RETRY_DELAY = 1
+
+
+def dumps(obj: Any) -> bytes:
+    """Serialize the same way JSONResponse does."""
+    return json.dumps(
+        jsonable_encoder(obj),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+class AuthorRecord:
+    __slots__ = ("id", "first_name", "last_name", "data", "detail")
+
+    def __init__(self, raw: dict[str, Any]):
+        author = OutputAuthorSchema.model_validate(raw)
+        self.id = author.id
+        self.first_name = author.first_name
+        self.last_name = author.last_name
+        # `data` is the list entry, `detail` is what gets embedded in a book
+        self.data = dumps(author)
+        self.detail = dumps(author.model_dump())
+
+
+class BookRecord:
+    __slots__ = ("id", "author_id", "data", "detail_prefix")
+
+    def __init__(self, raw: dict[str, Any]):
+        book = BookListOutSchema.model_validate(raw)
+        self.id = book.id
+        self.author_id = book.author_id
+        self.data = dumps(book)
+        detail = book.model_dump(exclude={"author_id"})
+        detail["created_at"] = raw["created_at"]
+        # the author is spliced in when the detail is served
+        self.detail_prefix = dumps(detail)[:-1] + b',"author":['
+
+
+class CatalogSnapshot:
+    """In-process copy of books and authors kept current by change streams.
+
+    Each collection is loaded in full and then followed through a change
+    stream. The snapshot is only served while every stream has reported in
+    within `max_staleness` seconds; otherwise callers fall back to Mongo.
+    """
+
+    def __init__(self, max_staleness: float = 5.0):
+        self.max_staleness = max_staleness
+        self.books: dict[PydanticObjectId, BookRecord] = {}
+        self.authors: dict[PydanticObjectId, AuthorRecord] = {}
+        self._books_body: Optional[bytes] = None
+        # `_books_body` compressed once per content encoding
+        self._books_body_encoded: dict[str, bytes] = {}
+        self._confirmed_at: dict[str, float] = {}
+        self._resyncs = 0
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self) -> None:
+        for document in (Author, Book):
+            self._tasks.append(asyncio.create_task(self._follow(document)))
+        metrics.register("catalog_snapshot", self.stats)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        metrics.unregister("catalog_snapshot")
+
+    @property
+    def is_fresh(self) -> bool:
+        now = time.time()
+        return len(self._confirmed_at) == 2 and all(
+            now - confirmed_at <= self.max_staleness
+            for confirmed_at in self._confirmed_at.values()
+        )
+
+    def covers(self, last_modified: Optional[datetime]) -> bool:
+        """Whether every stream has caught up past a catalog write.
+
+        Version counters are bumped as soon as a write returns, while its
+        change event may still be in flight; serving the snapshot before then
+        would pair an old body with the new ETag.
+        """
+        if last_modified is None:
+            return True
+        # Last-Modified has one second resolution
+        since = last_modified.timestamp() + 1
+        return all(
+            confirmed_at >= since for confirmed_at in self._confirmed_at.values()
+        )
+
+    def _invalidate(self) -> None:
+        self._books_body = None
+        self._books_body_encoded = {}
+
+    def _records(self, document) -> dict:
+        return self.books if document is Book else self.authors
+
+    def _apply(self, document, raw: dict[str, Any]) -> None:
+        record = BookRecord(raw) if document is Book else AuthorRecord(raw)
+        self._records(document)[record.id] = record
+        self._invalidate()
+
+    def _remove(self, document, doc_id: PydanticObjectId) -> None:
+        self._records(document).pop(doc_id, None)
+        self._invalidate()
+
+    async def _load(self, document) -> None:
+        record_type = BookRecord if document is Book else AuthorRecord
+        records = {}
+        async for raw in document.get_motor_collection().find():
+            record = record_type(raw)
+            records[record.id] = record
+        if document is Book:
+            self.books = records
+        else:
+            self.authors = records
+        self._invalidate()
+        self._resyncs += 1
+
+    async def _follow(self, document) -> None:
+        name = document.Settings.name
+        collection = document.get_motor_collection()
+        resume_token = None
+        max_await_ms = max(int(self.max_staleness * 1000 / 2), 1)
+        while True:
+            try:
+                async with collection.watch(
+                    full_document="updateLookup",
+                    resume_after=resume_token,
+                    max_await_time_ms=max_await_ms,
+                ) as stream:
+                    if resume_token is None:
+                        # the stream is open before the load, so nothing is missed
+                        await self._load(document)
+                    while stream.alive:
+                        change = await stream.try_next()
+                        self._confirmed_at[name] = time.time()
+                        resume_token = stream.resume_token
+                        if change is None:
+                            continue
+                        self._handle(document, change)
+                        if change["operationType"] == "invalidate":
+                            resume_token = None
+                            break
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as exc:
+                self._confirmed_at.pop(name, None)
+                if exc.code in RESUME_TOKEN_LOST_CODES:
+                    logger.warning("Resume token lost for %s, resyncing", name)
+                    resume_token = None
+                else:
+                    logger.exception("Change stream on %s failed", name)
+                    await asyncio.sleep(RETRY_DELAY)
+            except PyMongoError:
+                self._confirmed_at.pop(name, None)
+                logger.exception("Change stream on %s failed", name)
+                await asyncio.sleep(RETRY_DELAY)
+            except Exception:
+                # e.g. a document that no longer fits the schemas; the change
+                # was not applied, so only a full reload is safe
+                self._confirmed_at.pop(name, None)
+                logger.exception("Could not apply %s change, resyncing", name)
+                resume_token = None
+                await asyncio.sleep(RETRY_DELAY)
+
+    def _handle(self, document, change: dict[str, Any]) -> None:
+        operation = change["operationType"]
+        if operation in ("insert", "update", "replace"):
+            if change.get("fullDocument"):
+                self._apply(document, change["fullDocument"])
+            else:
+                # deleted before the lookup ran
+                self._remove(document, change["documentKey"]["_id"])
+        elif operation == "delete":
+            self._remove(document, change["documentKey"]["_id"])
+
+    def books_body(self) -> bytes:
+        """The full `GET /books/` response body."""
+        if self._books_body is None:
+            items = b",".join(record.data for record in self.books.values())
+            self._books_body = b'{"status":"success","detail":[' + items + b"]}"
+        return self._books_body
+
+    def encoded_books_body(
+        self, encoding: Optional[str], minimum_size: int = 0
+    ) -> tuple[bytes, Optional[str]]:
+        """The `GET /books/` body compressed with `encoding`, if worth it.
+
+        Returns the body and the encoding actually applied.
+        """
+        body = self.books_body()
+        if encoding is None or len(body) < minimum_size:
+            return body, None
+        if encoding not in self._books_body_encoded:
+            self._books_body_encoded[encoding] = compress(encoding, body)
+        return self._books_body_encoded[encoding], encoding
+
+    def book_body(self, book_id: PydanticObjectId) -> Optional[bytes]:
+        """The `GET /books/{book_id}` response body, or None if unknown."""
+        record = self.books.get(book_id)
+        if record is None:
+            return None
+        author = self.authors.get(record.author_id)
+        return (
+            b'{"status":"success","detail":'
+            + record.detail_prefix
+            + (author.detail if author else b"")
+            + b"]}}"
+        )
+
+    def authors_body(
+        self, first_name: Optional[str] = None, last_name: Optional[str] = None
+    ) -> bytes:
+        """The `GET /authors/` response body for the given filters."""
+        items = b",".join(
+            record.data
+            for record in self.authors.values()
+            if (not first_name or record.first_name == first_name.lower())
+            and (not last_name or record.last_name == last_name.lower())
+        )
+        return b'{"authors":[' + items + b"]}"
+
+    def memory_footprint(self) -> int:
+        """Approximate bytes held by the records and their payloads."""
+        total = sys.getsizeof(self.books) + sys.getsizeof(self.authors)
+        for records in (self.books, self.authors):
+            for record in records.values():
+                total += sys.getsizeof(record)
+                total += sum(
+                    sys.getsizeof(getattr(record, slot))
+                    for slot in record.__slots__
+                    if isinstance(getattr(record, slot), bytes)
+                )
+        if self._books_body is not None:
+            total += sys.getsizeof(self._books_body)
+        total += sum(sys.getsizeof(body) for body in self._books_body_encoded.values())
+        return total
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "fresh": self.is_fresh,
+            "books": len(self.books),
+            "authors": len(self.authors),
+            "memory_bytes": self.memory_footprint(),
+            "resyncs": self._resyncs,
+        }
+
+
+def get_fresh_snapshot(
+    request, last_modified: Optional[datetime] = None
+) -> Optional[CatalogSnapshot]:
+    """Return the worker's snapshot if it is enabled, within staleness and
+    has seen every write up to `last_modified`."""
+    snapshot = getattr(request.app.state, "catalog", None)
+    if snapshot is None:
+        return None
+    if not snapshot.is_fresh or not snapshot.covers(last_modified):
+        metrics.inc("catalog_snapshot_fallbacks")
+        return None
+    metrics.inc("catalog_snapshot_hits")
+    return snapshot
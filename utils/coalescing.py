@@ -0,0 +1,120 @@
+import asyncio
+from collections.abc import Awaitable, Hashable
+from typing import Any, Callable, Optional, Type, TypeVar
+
+from beanie import Document, PydanticObjectId
+from beanie.odm.utils.parsing import parse_obj
+
+from utils import metrics
+
+T = TypeVar("T")
+D = TypeVar("D", bound=Document)
+
+
+class SingleFlight:
+    """Shares one in-flight call between concurrent callers of the same key.
+
+    Only calls that overlap are merged; nothing is cached once the call
+    returns. Callers get the same result object, so it must not be mutated.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Future] = {}
+        self.requests = 0
+        self.executions = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        self.requests += 1
+        future = self._calls.get(key)
+        if future is None:
+            self.executions += 1
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+        # shielded, so one caller going away does not cancel the others
+        return await asyncio.shield(future)
+
+
+class BatchLoader:
+    """Merges `load` calls made in the same event-loop tick into one `$in` query.
+
+    A load for an id whose query is still running joins that query instead
+    of starting another. Raw documents are shared, but every caller gets its
+    own parsed instance.
+    """
+
+    def __init__(self, document: Type[D]):
+        self.document = document
+        # ids waiting for the next dispatch, and ids whose query is running
+        self._queued: dict[PydanticObjectId, asyncio.Future] = {}
+        self._in_flight: dict[PydanticObjectId, asyncio.Future] = {}
+        self.requests = 0
+        self.queries = 0
+
+    async def load(self, doc_id: PydanticObjectId) -> Optional[D]:
+        self.requests += 1
+        future = self._queued.get(doc_id) or self._in_flight.get(doc_id)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            if not self._queued:
+                loop.call_soon(self._dispatch)
+            future = loop.create_future()
+            self._queued[doc_id] = future
+        raw = await asyncio.shield(future)
+        return parse_obj(self.document, raw) if raw is not None else None
+
+    def _dispatch(self) -> None:
+        batch, self._queued = self._queued, {}
+        self._in_flight.update(batch)
+        self.queries += 1
+        asyncio.ensure_future(self._fetch(batch))
+
+    async def _fetch(self, batch: dict[PydanticObjectId, asyncio.Future]) -> None:
+        try:
+            found = {
+                raw["_id"]: raw
+                async for raw in self.document.get_motor_collection().find(
+                    {"_id": {"$in": list(batch)}}
+                )
+            }
+        except Exception as exc:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        else:
+            for doc_id, future in batch.items():
+                if not future.done():
+                    future.set_result(found.get(doc_id))
+        finally:
+            for doc_id, future in batch.items():
+                if self._in_flight.get(doc_id) is future:
+                    del self._in_flight[doc_id]
+
+
+single_flight = SingleFlight()
+_loaders: dict[Type[Document], BatchLoader] = {}
+
+
+def get_loader(document: Type[D]) -> BatchLoader:
+    if document not in _loaders:
+        _loaders[document] = BatchLoader(document)
+    return _loaders[document]
+
+
+def stats() -> dict[str, Any]:
+    """Lookups requested per query actually run; 1.0 means nothing merged."""
+    requests = single_flight.requests + sum(
+        loader.requests for loader in _loaders.values()
+    )
+    executions = single_flight.executions + sum(
+        loader.queries for loader in _loaders.values()
+    )
+    return {
+        "requests": requests,
+        "executions": executions,
+        "ratio": round(requests / executions, 3) if executions else 1.0,
+    }
+
+
+metrics.register("coalescing", stats)
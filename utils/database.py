@@ -2,11 +2,16 @@ from beanie import init_beanie
 from motor.motor_asyncio import AsyncIOMotorClient
 
 from config.settings import settings
-from models import authors, books, carts, tokens, users
+from models import authors, books, carts, facets, tokens, users
+from utils.readiness import mongo_pool
 
 
-async def init_db() -> None:
-    client = AsyncIOMotorClient(settings.MONGO_URI)
+async def init_db() -> AsyncIOMotorClient:
+    client = AsyncIOMotorClient(
+        settings.MONGO_URI,
+        minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+        event_listeners=[mongo_pool],
+    )
 
     await init_beanie(
         database=client[settings.MONGO_DB],
@@ -16,5 +21,7 @@ async def init_db() -> None:
             authors.Author,
             books.Book,
             carts.Cart,
+            facets.BookFacet,
         ],
     )
+    return client
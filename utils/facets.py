@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Any, Optional
+from uuid import uuid4
+
+from models.books import Book
+from models.facets import FACET_FIELDS, BookFacet
+from utils import metrics
+
+if TYPE_CHECKING:
+    import aioredis
+
+logger = logging.getLogger(__name__)
+
+# held by the worker running the periodic full recount
+REFRESH_LOCK_KEY = "book_facets:refresh"
+
+
+def book_facet_values(book: Book) -> dict[str, list]:
+    """The facet values a book counts towards."""
+    return {
+        "genre": list(book.genre),
+        "lanugage": [book.lanugage],
+        "author": [book.author_id],
+    }
+
+
+def facet_pipeline(
+    run_id: str, refreshed_at: datetime, values: Optional[dict[str, list]] = None
+) -> list[dict[str, Any]]:
+    """Aggregation that recounts the given facet values, or all of them,
+    and merges the counts into `book_facets`.
+
+    A row already written by a run that started later is left alone, so a
+    slow run can never overwrite newer counts.
+    """
+    branches = {}
+    for name, field in FACET_FIELDS.items():
+        stages = [{"$unwind": f"${field}"}] if field == "genre" else []
+        if values is not None:
+            stages.append({"$match": {field: {"$in": values.get(name, [])}}})
+        stages.append({"$group": {"_id": f"${field}", "books": {"$sum": 1}}})
+        branches[name] = stages
+    rows = [
+        {
+            "$map": {
+                "input": f"${name}",
+                "in": {
+                    "facet": name,
+                    "value": {"$toString": "$$this._id"},
+                    "books": "$$this.books",
+                },
+            }
+        }
+        for name in FACET_FIELDS
+    ]
+
+    pipeline = []
+    if values is not None:
+        pipeline.append(
+            {
+                "$match": {
+                    "$or": [
+                        {field: {"$in": values.get(name, [])}}
+                        for name, field in FACET_FIELDS.items()
+                    ]
+                }
+            }
+        )
+    return pipeline + [
+        {"$facet": branches},
+        {"$project": {"rows": {"$concatArrays": rows}}},
+        {"$unwind": "$rows"},
+        {"$replaceWith": "$rows"},
+        {"$set": {"run_id": run_id, "refreshed_at": refreshed_at}},
+        {
+            "$merge": {
+                "into": BookFacet.Settings.name,
+                "on": ["facet", "value"],
+                "whenMatched": [
+                    {
+                        "$set": {
+                            field: {
+                                "$cond": [
+                                    {"$gte": ["$$new.refreshed_at", "$refreshed_at"]},
+                                    f"$$new.{field}",
+                                    f"${field}",
+                                ]
+                            }
+                            for field in ("books", "run_id", "refreshed_at")
+                        }
+                    }
+                ],
+                "whenNotMatched": "insert",
+            }
+        },
+    ]
+
+
+async def refresh_facets(values: Optional[dict[str, list]] = None) -> None:
+    """Recount the given facet values, or every facet when `values` is None.
+
+    Values that no book has any more are dropped.
+    """
+    run_id = uuid4().hex
+    refreshed_at = datetime.now(timezone.utc)
+    pipeline = facet_pipeline(run_id, refreshed_at, values)
+    await Book.get_motor_collection().aggregate(pipeline).to_list(None)
+
+    # rows this run did not write: no book has the value any more. Rows a
+    # later run has written since are kept.
+    stale = {"run_id": {"$ne": run_id}, "refreshed_at": {"$lt": refreshed_at}}
+    if values is not None:
+        stale["$or"] = [
+            {"facet": name, "value": {"$in": [str(value) for value in values[name]]}}
+            for name in values
+        ]
+    await BookFacet.find(stale).delete()
+    metrics.inc("facet_refreshes")
+
+
+async def get_facets(facet: Optional[str] = None) -> dict[str, dict[str, int]]:
+    """Book counts per value, for one facet or all of them."""
+    query = BookFacet.find(BookFacet.facet == facet) if facet else BookFacet.find()
+    facets = {name: {} for name in ([facet] if facet else FACET_FIELDS)}
+    async for row in query.sort(-BookFacet.books):
+        facets[row.facet][row.value] = row.books
+    return facets
+
+
+class FacetRefresher:
+    """Periodically recounts every facet, correcting any incremental drift.
+
+    Workers share a redis lock per interval, so only one of them recounts.
+    """
+
+    def __init__(self, redis: "aioredis.Redis", interval: float):
+        self.redis = redis
+        self.interval = interval
+        self._task = None
+        self._last_duration = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+        metrics.register("book_facets", self.stats)
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        metrics.unregister("book_facets")
+
+    async def _run(self) -> None:
+        while True:
+            started = time.monotonic()
+            try:
+                if await self.redis.set(
+                    REFRESH_LOCK_KEY, 1, ex=max(int(self.interval), 1), nx=True
+                ):
+                    await refresh_facets()
+                    self._last_duration = time.monotonic() - started
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Refreshing book facets failed")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "interval_seconds": self.interval,
+            "last_refresh_seconds": self._last_duration,
+        }
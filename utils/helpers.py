@@ -4,14 +4,19 @@ from beanie import Document, PydanticObjectId
 from fastapi import HTTPException, status
 from fastapi.responses import JSONResponse
 
+from utils.coalescing import get_loader
+
 T = TypeVar("T", bound=Document)
 
 
 async def get_object_or_404(
     obj: Type[T], key: PydanticObjectId
 ) -> Union[T, HTTPException]:
-    """Get object or raise 404"""
-    result = await obj.get(key)
+    """Get object or raise 404.
+
+    Lookups made in the same event-loop tick share one `$in` query.
+    """
+    result = await get_loader(obj).load(key)
     if not result:
         raise error_response(
             status_code=status.HTTP_404_NOT_FOUND, message=f"{obj.__name__} not found"
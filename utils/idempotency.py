@@ -0,0 +1,221 @@
+import asyncio
+import base64
+import hashlib
+import json
+import time
+from typing import Any, Optional
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse, Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from utils import metrics
+
+HEADER = "idempotency-key"
+MAX_KEY_LENGTH = 255
+KEY_PREFIX = "idempotency:"
+# how often a duplicate checks whether the first request has finished
+POLL_INTERVAL = 0.05
+
+
+def storage_key(scope: Scope, key: str) -> str:
+    """Redis key for an idempotency key, scoped to the caller and the route."""
+    caller = Headers(scope=scope).get("authorization", "")
+    digest = hashlib.sha256(
+        "\n".join((caller, scope["method"], scope["path"], key)).encode()
+    ).hexdigest()
+    return f"{KEY_PREFIX}{digest}"
+
+
+def fingerprint(body: bytes, content_type: str = "") -> str:
+    """Digest of a request body that is stable across client retries."""
+    _, _, boundary = content_type.partition("boundary=")
+    if boundary:
+        # clients pick a new multipart boundary for every attempt
+        body = body.replace(boundary.strip('"').encode(), b"")
+    return hashlib.sha256(body).hexdigest()
+
+
+def encode_response(
+    fingerprint: str, status_code: int, headers: list[tuple[bytes, bytes]], body: bytes
+) -> str:
+    return json.dumps(
+        {
+            "fingerprint": fingerprint,
+            "status": status_code,
+            "headers": [
+                [name.decode("latin-1"), value.decode("latin-1")]
+                for name, value in headers
+            ],
+            "body": base64.b64encode(body).decode(),
+        }
+    )
+
+
+def decode_response(record: dict[str, Any]) -> Response:
+    response = Response(
+        content=base64.b64decode(record["body"]), status_code=record["status"]
+    )
+    response.raw_headers = [
+        (name.encode("latin-1"), value.encode("latin-1"))
+        for name, value in record["headers"]
+    ] + [(b"idempotent-replayed", b"true")]
+    return response
+
+
+def _error(status_code: int, message: str, headers: Optional[dict] = None):
+    return JSONResponse(
+        status_code=status_code,
+        content={"status": "error", "message": message},
+        headers=headers,
+    )
+
+
+class IdempotencyMiddleware:
+    """Runs a request carrying an `Idempotency-Key` header at most once.
+
+    The first request with a key claims it in redis and its response is
+    stored for `ttl` seconds; a repeat gets that response replayed. A repeat
+    arriving while the first is still running waits up to `wait` seconds for
+    it. A key reused with a different body is rejected with 422. 5xx
+    responses are not stored, so the client can retry them.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        paths: tuple[str, ...],
+        ttl: int = 24 * 60 * 60,
+        lock_timeout: int = 60,
+        wait: float = 10.0,
+    ):
+        self.app = app
+        self.paths = paths
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.wait = wait
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or scope["path"] not in self.paths
+            or (key := Headers(scope=scope).get(HEADER)) is None
+        ):
+            await self.app(scope, receive, send)
+            return
+        if not key or len(key) > MAX_KEY_LENGTH:
+            await _error(400, "Invalid Idempotency-Key header")(scope, receive, send)
+            return
+
+        redis = scope["app"].state.redis
+        redis_key = storage_key(scope, key)
+        messages, body = await _read_body(receive)
+        request_fingerprint = fingerprint(
+            body, Headers(scope=scope).get("content-type", "")
+        )
+
+        deadline = time.monotonic() + self.wait
+        while True:
+            pending = json.dumps({"fingerprint": request_fingerprint})
+            if await redis.set(redis_key, pending, ex=self.lock_timeout, nx=True):
+                break
+            raw = await redis.get(redis_key)
+            if raw is None:
+                # the first request failed and released the key
+                continue
+            record = json.loads(raw)
+            if record["fingerprint"] != request_fingerprint:
+                metrics.inc("idempotency_mismatches")
+                response = _error(
+                    422, "Idempotency-Key was already used with a different request"
+                )
+                await response(scope, receive, send)
+                return
+            if "status" in record:
+                metrics.inc("idempotency_replays")
+                await decode_response(record)(scope, receive, send)
+                return
+            if time.monotonic() >= deadline:
+                response = _error(
+                    409,
+                    "A request with this Idempotency-Key is still in progress",
+                    headers={"Retry-After": "1"},
+                )
+                await response(scope, receive, send)
+                return
+            await asyncio.sleep(POLL_INTERVAL)
+
+        await self._run_once(
+            scope,
+            _replay(messages, receive),
+            send,
+            redis,
+            redis_key,
+            request_fingerprint,
+        )
+
+    async def _run_once(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        redis,
+        redis_key: str,
+        request_fingerprint: str,
+    ) -> None:
+        start: Optional[Message] = None
+        chunks: list[bytes] = []
+        stored = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start, stored
+            if message["type"] == "http.response.start":
+                start = message
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body", False) and start["status"] < 500:
+                    # stored before background tasks run, so duplicates
+                    # are not held up by them
+                    await redis.set(
+                        redis_key,
+                        encode_response(
+                            request_fingerprint,
+                            start["status"],
+                            start["headers"],
+                            b"".join(chunks),
+                        ),
+                        ex=self.ttl,
+                    )
+                    stored = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if not stored:
+                await redis.delete(redis_key)
+
+
+async def _read_body(receive: Receive) -> tuple[list[Message], bytes]:
+    messages = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        messages.append(message)
+        if message["type"] != "http.request":
+            break
+        more_body = message.get("more_body", False)
+    body = b"".join(message.get("body", b"") for message in messages)
+    return messages, body
+
+
+def _replay(messages: list[Message], receive: Receive) -> Receive:
+    pending = list(messages)
+
+    async def replay() -> Message:
+        if pending:
+            return pending.pop(0)
+        return await receive()
+
+    return replay
@@ -0,0 +1,132 @@
+import asyncio
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Optional
+
+from PIL import Image, ImageOps, features
+from starlette.concurrency import run_in_threadpool
+
+from utils.storage import Storage
+
+# longest edge in pixels for every rendition stored with a book
+RENDITION_SIZES = {"small": 160, "medium": 320, "large": 640}
+# the rendition kept in `Book.image_url` for existing clients
+DEFAULT_RENDITION = "large"
+FOLDER = "book_buy"
+# what a corrupt, truncated or oversized upload raises while decoding;
+# UnidentifiedImageError is an OSError
+DECODE_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+@dataclass
+class Rendition:
+    name: str
+    data: bytes
+    extension: str
+    width: int
+    height: int
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def public_id(image_hash: str, name: str) -> str:
+    return f"{FOLDER}/{image_hash}/{name}"
+
+
+def unused_image_ids(books, still_used: set[str]) -> list[str]:
+    """Public ids of the images of deleted `books` that no remaining book uses.
+
+    `still_used` holds the content hashes still referenced by other books.
+    Books from before renditions existed have one image stored by title.
+    """
+    public_ids = []
+    seen = set(still_used)
+    for book in books:
+        if book.image_hash is None:
+            public_ids.append(f"{FOLDER}/{book.title}")
+        elif book.image_hash not in seen:
+            public_ids.extend(public_id(book.image_hash, name) for name in book.images)
+            seen.add(book.image_hash)
+    return public_ids
+
+
+def render(
+    data: bytes, sizes: dict[str, int], image_format: str, quality: int
+) -> list[Rendition]:
+    """Decode `data` and encode one rendition per entry of `sizes`.
+
+    Runs in a worker process, so it only takes and returns picklable values.
+    """
+    if image_format == "webp" and not features.check("webp"):
+        image_format = "jpeg"
+    image = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+    if image_format == "jpeg" or image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGB")
+
+    renditions = []
+    for name, size in sizes.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        out = BytesIO()
+        if image_format == "webp":
+            resized.save(out, "WEBP", quality=quality, method=4)
+        else:
+            resized.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+        renditions.append(
+            Rendition(
+                name=name,
+                data=out.getvalue(),
+                extension="webp" if image_format == "webp" else "jpg",
+                width=resized.width,
+                height=resized.height,
+            )
+        )
+    return renditions
+
+
+def init_image_pool(workers: int) -> None:
+    global _pool
+    _pool = ProcessPoolExecutor(max_workers=workers)
+
+
+def shutdown_image_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def process_image(
+    data: bytes,
+    sizes: dict[str, int] = RENDITION_SIZES,
+    image_format: str = "webp",
+    quality: int = 80,
+) -> list[Rendition]:
+    """Render `data` in the process pool, or in the default thread pool if no
+    process pool was started."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pool, render, data, sizes, image_format, quality)
+
+
+async def upload_renditions(
+    storage: Storage, image_hash: str, renditions: list[Rendition]
+) -> dict[str, str]:
+    """Upload every rendition concurrently and return their urls by name."""
+    urls = await asyncio.gather(
+        *(
+            run_in_threadpool(
+                storage.upload,
+                rendition.data,
+                public_id(image_hash, rendition.name),
+                rendition.extension,
+            )
+            for rendition in renditions
+        )
+    )
+    return {rendition.name: url for rendition, url in zip(renditions, urls)}
@@ -0,0 +1,147 @@
+import time
+from typing import Any, Optional
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from utils import metrics
+
+# share of the concurrency limit each class may fill; lower classes are shed
+# first as the limit shrinks
+PRIORITY_SHARES = {"high": 1.0, "normal": 0.85, "low": 0.6}
+# never limited, so probes and metrics keep answering under overload
+EXEMPT_PATHS = ("/healthcheck", "/readiness", "/metrics")
+# routes that are slow by design (argon2, image processing and uploads) are
+# judged against their own latency target instead of the shared one
+ROUTE_TARGET_LATENCIES = {
+    ("POST", "/books/"): 10.0,
+    ("POST", "/users/register"): 2.0,
+    ("POST", "/users/access-token"): 2.0,
+    ("POST", "/users/change-password"): 2.0,
+}
+
+
+def classify(scope: Scope) -> Optional[str]:
+    """Priority class of a request, or None when it is never shed."""
+    path = scope["path"]
+    if path.startswith(EXEMPT_PATHS):
+        return None
+    if path.startswith(("/carts", "/users")):
+        return "high"
+    if scope["method"] == "GET" and path.startswith(("/books", "/authors")):
+        if "authorization" not in Headers(scope=scope):
+            return "low"
+    return "normal"
+
+
+class AIMDLimiter:
+    """Additive-increase/multiplicative-decrease concurrency limit.
+
+    Every request finishing within `target_latency` grows the limit by about
+    one per limit's worth of requests; a slower one or a 5xx shrinks it by
+    `backoff`, at most once per `target_latency` so one burst of slow
+    responses counts once.
+    """
+
+    def __init__(
+        self,
+        initial: int = 100,
+        minimum: int = 10,
+        maximum: int = 1000,
+        target_latency: float = 0.25,
+        backoff: float = 0.9,
+    ):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.in_flight = 0
+        self.latency = 0.0
+        self._last_decrease = 0.0
+        self.admitted = dict.fromkeys(PRIORITY_SHARES, 0)
+        self.shed = dict.fromkeys(PRIORITY_SHARES, 0)
+
+    def try_acquire(self, priority: str) -> bool:
+        if self.in_flight >= self.limit * PRIORITY_SHARES[priority]:
+            self.shed[priority] += 1
+            return False
+        self.in_flight += 1
+        self.admitted[priority] += 1
+        return True
+
+    def release(
+        self,
+        latency: float,
+        failed: bool = False,
+        target_latency: Optional[float] = None,
+    ) -> None:
+        target_latency = target_latency or self.target_latency
+        self.in_flight -= 1
+        self.latency = (
+            latency if not self.latency else 0.9 * self.latency + 0.1 * latency
+        )
+        now = time.monotonic()
+        if failed or latency > target_latency:
+            if now - self._last_decrease >= self.target_latency:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+                self._last_decrease = now
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "latency_ewma_seconds": round(self.latency, 4),
+            "admitted": dict(self.admitted),
+            "shed": dict(self.shed),
+        }
+
+
+class LoadSheddingMiddleware:
+    """Rejects requests over the adaptive limit with 503 and Retry-After."""
+
+    def __init__(self, app: ASGIApp, limiter: AIMDLimiter, retry_after: int = 1):
+        self.app = app
+        self.limiter = limiter
+        self.retry_after = retry_after
+        metrics.register("limiter", limiter.stats)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or (priority := classify(scope)) is None:
+            await self.app(scope, receive, send)
+            return
+        if not self.limiter.try_acquire(priority):
+            response = JSONResponse(
+                status_code=503,
+                content={"status": "error", "message": "Server is overloaded"},
+                headers={"Retry-After": str(self.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        status_code = 500
+        started = time.monotonic()
+        latency = None
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code, latency
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                # up to the first byte, so slow clients reading the body
+                # do not count as server latency
+                latency = time.monotonic() - started
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.limiter.release(
+                latency if latency is not None else time.monotonic() - started,
+                failed=status_code >= 500,
+                target_latency=ROUTE_TARGET_LATENCIES.get(
+                    (scope["method"], scope["path"])
+                ),
+            )
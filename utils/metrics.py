@@ -0,0 +1,31 @@
+from collections import defaultdict
+from typing import Any, Callable
+
+_counters: dict[str, float] = defaultdict(float)
+_collectors: dict[str, Callable[[], dict[str, Any]]] = {}
+
+
+def inc(name: str, value: float = 1) -> None:
+    """Increment a process-wide counter."""
+    _counters[name] += value
+
+
+def get(name: str) -> float:
+    return _counters.get(name, 0)
+
+
+def register(name: str, collector: Callable[[], dict[str, Any]]) -> None:
+    """Register a callable that reports live state under `name`."""
+    _collectors[name] = collector
+
+
+def unregister(name: str) -> None:
+    _collectors.pop(name, None)
+
+
+def collect() -> dict[str, Any]:
+    """Return every counter and the output of every registered collector."""
+    return {
+        "counters": dict(_counters),
+        **{name: collector() for name, collector in _collectors.items()},
+    }
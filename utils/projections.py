@@ -0,0 +1,43 @@
+from functools import lru_cache
+from typing import Optional, Type
+
+from fastapi import status
+from pydantic import BaseModel, create_model
+
+from utils.helpers import error_response
+
+
+def parse_fields(
+    fields: Optional[str], allowed: frozenset[str]
+) -> Optional[tuple[str, ...]]:
+    """Parse a `fields=a,b` query parameter against an allowlist.
+
+    Returns a sorted tuple so equal field sets share one cached model.
+    """
+    if not fields:
+        return None
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    if unknown := requested - allowed:
+        raise error_response(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            message=f"Unknown fields: {', '.join(sorted(unknown))}. "
+            f"Allowed fields: {', '.join(sorted(allowed))}",
+        )
+    return tuple(sorted(requested))
+
+
+@lru_cache(maxsize=256)
+def projection_model(
+    schema: Type[BaseModel], fields: tuple[str, ...]
+) -> Type[BaseModel]:
+    """Build a model holding only `fields` (and `id`) of `schema`.
+
+    Beanie derives the Mongo projection from the model's fields, so anything
+    not requested is never fetched, decoded or validated.
+    """
+    definitions = {
+        name: (info.annotation, info)
+        for name, info in schema.model_fields.items()
+        if name in fields or name == "id"
+    }
+    return create_model(f"{schema.__name__}Fields", **definitions)
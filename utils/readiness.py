@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Optional
+
+from beanie import PydanticObjectId
+from fastapi.encoders import jsonable_encoder
+from pymongo import monitoring
+
+from schemas.authors import OutputAuthorSchema
+from schemas.books import BookDetailOutSchema, BookListOutSchema
+from schemas.carts import OutputCartSchema
+from utils import coalescing, metrics
+
+logger = logging.getLogger(__name__)
+
+# seconds a dependency gets to answer the readiness ping
+PING_TIMEOUT = 1.0
+# seconds between warm-up rounds while the pools are still filling
+WARM_UP_RETRY_DELAY = 0.1
+
+
+class PoolListener(monitoring.ConnectionPoolListener):
+    """Counts Mongo connections open and checked out across every pool."""
+
+    def __init__(self):
+        self.open = 0
+        self.checked_out = 0
+
+    def connection_created(self, event):
+        self.open += 1
+
+    def connection_closed(self, event):
+        self.open -= 1
+
+    def connection_checked_out(self, event):
+        self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+
+mongo_pool = PoolListener()
+
+
+def exercise_models() -> None:
+    """Validate and serialize one instance of every hot response model, so
+    the first real request does not pay for it."""
+    author = {"_id": PydanticObjectId(), "first_name": "warm", "last_name": "up"}
+    book = {
+        "_id": PydanticObjectId(),
+        "title": "warm up",
+        "isbn": "0",
+        "price": 0,
+        "description": "",
+        "lanugage": "en",
+        "author_id": author["_id"],
+        "genre": [],
+        "image_url": "",
+        "created_at": datetime.utcnow(),
+    }
+    cart = {"_id": PydanticObjectId(), "cart_items": [], "total_price": 0}
+    for schema, data in (
+        (OutputAuthorSchema, author),
+        (BookListOutSchema, book),
+        (BookDetailOutSchema, {**book, "author": [author]}),
+        (OutputCartSchema, cart),
+    ):
+        jsonable_encoder(schema.model_validate(data).model_dump())
+
+
+class Readiness:
+    """Warms the Mongo and Redis pools, then tracks whether the worker can
+    take traffic.
+
+    Also samples event-loop lag every `lag_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        mongo,
+        redis,
+        mongo_pool_size: int,
+        redis_pool_size: int,
+        lag_interval: float,
+    ):
+        self.mongo = mongo
+        self.redis = redis
+        self.mongo_pool_size = mongo_pool_size
+        self.redis_pool_size = redis_pool_size
+        self.lag_interval = lag_interval
+        self.warm = False
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self) -> None:
+        self._tasks = [
+            asyncio.create_task(self._warm_up()),
+            asyncio.create_task(self._sample_lag()),
+        ]
+        metrics.register("runtime", self.stats)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        metrics.unregister("runtime")
+
+    async def _warm_up(self) -> None:
+        started = time.monotonic()
+        while not self.warm:
+            try:
+                # concurrent commands open connections; pymongo only opens
+                # a couple at a time, so keep going until the pool is full
+                await asyncio.gather(
+                    *(
+                        self.mongo.admin.command("ping")
+                        for _ in range(self.mongo_pool_size)
+                    ),
+                    *(self.redis.ping() for _ in range(self.redis_pool_size)),
+                )
+                exercise_models()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Warming up failed, retrying")
+                await asyncio.sleep(1)
+                continue
+            if (
+                mongo_pool.open >= self.mongo_pool_size
+                and self.redis_pool()["open"] >= self.redis_pool_size
+            ):
+                self.warm = True
+                logger.info("Warmed up in %.3fs", time.monotonic() - started)
+            else:
+                await asyncio.sleep(WARM_UP_RETRY_DELAY)
+
+    async def _sample_lag(self) -> None:
+        while True:
+            expected = time.monotonic() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            lag = max(time.monotonic() - expected, 0.0)
+            self.lag = 0.8 * self.lag + 0.2 * lag
+            self.max_lag = max(self.max_lag, lag)
+
+    async def check(self) -> Optional[str]:
+        """None when ready, otherwise the reason the worker is not."""
+        if not self.warm:
+            return "warming up"
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(self.mongo.admin.command("ping"), self.redis.ping()),
+                PING_TIMEOUT,
+            )
+        except Exception as exc:
+            return f"dependency unavailable: {exc.__class__.__name__}"
+        return None
+
+    def redis_pool(self) -> dict[str, Any]:
+        pool = self.redis.connection_pool
+        return {
+            "open": pool._created_connections,
+            "in_use": len(pool._in_use_connections),
+            "max": pool.max_connections,
+        }
+
+    def stats(self) -> dict[str, Any]:
+        hits = metrics.get("catalog_snapshot_hits")
+        misses = metrics.get("catalog_snapshot_fallbacks")
+        return {
+            "warm": self.warm,
+            "event_loop_lag_seconds": round(self.lag, 4),
+            "event_loop_max_lag_seconds": round(self.max_lag, 4),
+            "mongo_pool": {
+                "open": mongo_pool.open,
+                "in_use": mongo_pool.checked_out,
+            },
+            "redis_pool": self.redis_pool(),
+            "cache_hit_rates": {
+                "catalog_snapshot": (
+                    round(hits / (hits + misses), 3) if hits + misses else None
+                ),
+                "coalescing_ratio": coalescing.stats()["ratio"],
+            },
+        }
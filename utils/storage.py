@@ -0,0 +1,63 @@
+import os
+from typing import Protocol
+
+import cloudinary
+import cloudinary.api
+import cloudinary.uploader
+
+
+class Storage(Protocol):
+    def upload(self, data: bytes, public_id: str, extension: str) -> str:
+        """Store `data` under `public_id` and return its public url."""
+
+    def delete(self, public_ids: list[str]) -> None:
+        """Remove the given resources, ignoring the ones that do not exist."""
+
+
+class CloudinaryStorage:
+    def __init__(self):
+        cloudinary.config(secure=True)
+
+    def upload(self, data: bytes, public_id: str, extension: str) -> str:
+        result = cloudinary.uploader.upload(
+            data, public_id=public_id, format=extension, overwrite=False
+        )
+        return result["secure_url"]
+
+    def delete(self, public_ids: list[str]) -> None:
+        # the admin api accepts up to 100 public ids per call
+        for start in range(0, len(public_ids), 100):
+            cloudinary.api.delete_resources(public_ids[start : start + 100])
+
+
+class LocalStorage:
+    def __init__(self, root: str, base_url: str):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+
+    def _path(self, public_id: str) -> str:
+        return os.path.join(self.root, *public_id.split("/"))
+
+    def upload(self, data: bytes, public_id: str, extension: str) -> str:
+        path = f"{self._path(public_id)}.{extension}"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        return f"{self.base_url}/{public_id}.{extension}"
+
+    def delete(self, public_ids: list[str]) -> None:
+        for public_id in public_ids:
+            directory, name = os.path.split(self._path(public_id))
+            if not os.path.isdir(directory):
+                continue
+            for filename in os.listdir(directory):
+                if os.path.splitext(filename)[0] == name:
+                    os.remove(os.path.join(directory, filename))
+
+
+def init_storage(kind: str, *, media_root: str, media_url: str) -> Storage:
+    if kind == "local":
+        return LocalStorage(root=media_root, base_url=media_url)
+    if kind == "cloudinary":
+        return CloudinaryStorage()
+    raise ValueError(f"Unknown image storage: {kind}")
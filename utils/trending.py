@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import TYPE_CHECKING, Any, Optional
+
+from beanie import PydanticObjectId
+
+from utils import metrics
+
+if TYPE_CHECKING:
+    import aioredis
+
+logger = logging.getLogger(__name__)
+
+# how much one event of each kind adds to a book's score
+EVENT_WEIGHTS = {"view": 1, "cart_add": 5}
+BUCKET_KEY_PREFIX = "trending:"
+# merged scores, rebuilt at most once per flush interval
+MERGED_KEY = "trending:merged"
+
+
+def bucket_key(bucket: int) -> str:
+    return f"{BUCKET_KEY_PREFIX}{bucket}"
+
+
+def bucket_weights(
+    now: float, bucket_seconds: int, buckets: int, decay: float
+) -> dict[str, float]:
+    """Weight of each recent bucket key, the current one first at 1.0."""
+    current = int(now // bucket_seconds)
+    return {bucket_key(current - age): decay**age for age in range(buckets)}
+
+
+class TrendingRecorder:
+    """Buffers book events in memory and adds them to redis in batches.
+
+    Scores go into one sorted set per `bucket_seconds`, which expires once it
+    is older than `buckets` buckets. Reads merge the recent buckets with
+    older ones weighted down by `decay` per bucket, so scores fade out.
+    At most `max_pending` distinct books are buffered between flushes;
+    events for other books are dropped and counted.
+    """
+
+    def __init__(
+        self,
+        redis: "aioredis.Redis",
+        flush_interval: float,
+        bucket_seconds: int,
+        buckets: int,
+        max_pending: int,
+        decay: float = 0.5,
+    ):
+        self.redis = redis
+        self.flush_interval = flush_interval
+        self.bucket_seconds = bucket_seconds
+        self.buckets = buckets
+        self.max_pending = max_pending
+        self.decay = decay
+        self._pending: Counter = Counter()
+        self._dropped = 0
+        self._flushed = 0
+        self._task = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+        metrics.register("trending", self.stats)
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self.flush()
+        metrics.unregister("trending")
+
+    def record(self, book_id: PydanticObjectId, kind: str) -> None:
+        member = str(book_id)
+        if member not in self._pending and len(self._pending) >= self.max_pending:
+            self._dropped += 1
+            return
+        self._pending[member] += EVENT_WEIGHTS[kind]
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Flushing trending events failed")
+
+    async def flush(self) -> int:
+        """Add the buffered scores to the current bucket."""
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, Counter()
+        key = bucket_key(int(time.time() // self.bucket_seconds))
+        pipe = self.redis.pipeline(transaction=False)
+        for member, score in pending.items():
+            pipe.zincrby(key, score, member)
+        pipe.expire(key, self.bucket_seconds * (self.buckets + 1))
+        try:
+            await pipe.execute()
+        except Exception:
+            # keep them for the next flush, within the same bound
+            for member, score in pending.items():
+                if member in self._pending or len(self._pending) < self.max_pending:
+                    self._pending[member] += score
+            raise
+        self._flushed += len(pending)
+        return len(pending)
+
+    async def top(self, limit: int) -> list[tuple[PydanticObjectId, float]]:
+        """The `limit` highest scoring books with their decayed scores."""
+        merged = await self.redis.zrevrange(MERGED_KEY, 0, limit - 1, withscores=True)
+        if not merged:
+            weights = bucket_weights(
+                time.time(), self.bucket_seconds, self.buckets, self.decay
+            )
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.zunionstore(MERGED_KEY, weights)
+            pipe.pexpire(MERGED_KEY, max(int(self.flush_interval * 1000), 1))
+            pipe.zrevrange(MERGED_KEY, 0, limit - 1, withscores=True)
+            *_, merged = await pipe.execute()
+        return [(PydanticObjectId(member.decode()), score) for member, score in merged]
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "dropped": self._dropped,
+            "flushed": self._flushed,
+            "flush_interval_seconds": self.flush_interval,
+        }
+
+
+def record_event(request, book_id: PydanticObjectId, kind: str) -> None:
+    """Record a book event if trending is enabled."""
+    recorder: Optional[TrendingRecorder] = getattr(request.app.state, "trending", None)
+    if recorder is not None:
+        recorder.record(book_id, kind)
@@ -0,0 +1,110 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+from uuid import uuid4
+
+from beanie import PydanticObjectId
+from fastapi import status
+from fastapi.requests import Request
+from fastapi.responses import Response
+
+VERSIONS_KEY = "catalog_versions"
+MODIFIED_KEY = "catalog_modified"
+# random per-hash value, so counters restarted after a redis flush or
+# eviction can never reproduce an ETag issued before it
+EPOCH_FIELD = "epoch"
+
+
+def new_epoch() -> str:
+    return uuid4().hex[:12]
+
+
+def _field(collection: str, doc_id: Optional[PydanticObjectId] = None) -> str:
+    return f"{collection}:{doc_id}" if doc_id else collection
+
+
+async def bump_version(
+    request: Request, collection: str, *doc_ids: PydanticObjectId
+) -> None:
+    """Bump the collection counter and the counters of the given documents."""
+    now = int(datetime.now(timezone.utc).timestamp())
+    fields = [_field(collection)] + [_field(collection, doc_id) for doc_id in doc_ids]
+    pipe = request.app.state.redis.pipeline(transaction=False)
+    pipe.hsetnx(VERSIONS_KEY, EPOCH_FIELD, new_epoch())
+    for field in fields:
+        pipe.hincrby(VERSIONS_KEY, field, 1)
+        pipe.hset(MODIFIED_KEY, field, now)
+    await pipe.execute()
+
+
+class CatalogValidators:
+    """ETag and Last-Modified computed from the catalog version counters."""
+
+    def __init__(self, etag: str, last_modified: Optional[datetime]):
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @property
+    def headers(self) -> dict[str, str]:
+        headers = {"ETag": self.etag}
+        if self.last_modified:
+            headers["Last-Modified"] = format_datetime(self.last_modified, usegmt=True)
+        return headers
+
+    def is_not_modified(self, request: Request) -> bool:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return self.etag in tags
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since and self.last_modified:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            return self.last_modified <= since
+        return False
+
+    def not_modified_response(self) -> Response:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=self.headers)
+
+
+def build_etag(
+    epoch: Optional[bytes],
+    fields: list[str],
+    versions: list[Optional[bytes]],
+    variant: str = "",
+) -> str:
+    """Weak ETag from the epoch and the counters of `fields`."""
+    tag = "-".join(
+        f"{field}.{int(version or 0)}" for field, version in zip(fields, versions)
+    )
+    tag = f"{epoch.decode() if epoch else '0'}:{tag}"
+    if variant:
+        tag = f"{tag};{variant}"
+    return f'W/"{tag}"'
+
+
+async def get_validators(
+    request: Request, *keys: tuple[str, Optional[PydanticObjectId]], variant: str = ""
+) -> CatalogValidators:
+    """Build validators from the counters of the given (collection, id) keys.
+
+    Only the counters in redis are read, never the documents themselves.
+    """
+    fields = [_field(collection, doc_id) for collection, doc_id in keys]
+    pipe = request.app.state.redis.pipeline(transaction=False)
+    # a lost hash gets a fresh epoch before any tag is built from it
+    pipe.hsetnx(VERSIONS_KEY, EPOCH_FIELD, new_epoch())
+    pipe.hmget(VERSIONS_KEY, [EPOCH_FIELD, *fields])
+    pipe.hmget(MODIFIED_KEY, fields)
+    _, (epoch, *versions), modified = await pipe.execute()
+
+    etag = build_etag(epoch, fields, versions, variant)
+    timestamps = [int(value) for value in modified if value]
+    last_modified = (
+        datetime.fromtimestamp(max(timestamps), tz=timezone.utc) if timestamps else None
+    )
+    return CatalogValidators(etag=etag, last_modified=last_modified)